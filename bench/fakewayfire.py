@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""A stand-in Wayfire IPC server on a unix socket, for benchmarking wayctl without a compositor.
+
+It speaks the length prefixed JSON protocol of the ipc plugin and emulates the
+requests wayctl sends: view and output queries, configure-view, set-workspace,
+the wm-actions toggles, view-shot/capture (a 1x1 png is written), stipc run
+(the launched app maps a view shortly after) and event subscriptions. Every
+request can be delayed to model a busy compositor, and the requests are
+counted so a benchmark can report its IPC round trips.
+
+    python bench/fakewayfire.py --views 100 --latency 0.5 /tmp/fake-wayfire.socket
+    WAYFIRE_SOCKET=/tmp/fake-wayfire.socket ./wayctl.py --view list
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import collections
+
+# 1x1 transparent png, what view-shot/capture writes for any view
+PNG_1X1 = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360606060000000050001a5f64540"
+    "0000000049454e44ae426082"
+)
+
+OUTPUT_WIDTH = 1920
+OUTPUT_HEIGHT = 1080
+
+
+class FakeWayfire:
+    def __init__(self, path, views=10, latency=0.0, map_delay=0.0, grid=3, pid=None):
+        self.path = path
+        self.LATENCY = latency # seconds every request waits before its reply
+        self.MAP_DELAY = map_delay # seconds between stipc run and the view-mapped event
+        self.lock = threading.Lock()
+        self.watchers = {}
+        self.requests = collections.Counter()
+        self.next_id = 1
+        self.next_pid = 200000
+        self.output = {
+            "id": 1,
+            "name": "FAKE-1",
+            "geometry": {"x": 0, "y": 0, "width": OUTPUT_WIDTH, "height": OUTPUT_HEIGHT},
+            "workarea": {"x": 0, "y": 0, "width": OUTPUT_WIDTH, "height": OUTPUT_HEIGHT},
+            "workspace": {"x": 0, "y": 0, "grid_width": grid, "grid_height": grid},
+            "wset-index": 1,
+        }
+        self.views = collections.OrderedDict()
+        self.focused = None
+        # the views belong to a live pid by default, so session save can read a cmdline
+        pid = pid or os.getpid()
+        for i in range(views):
+            app_id = "kitty" if i == 0 else "app{0}".format(i % 7)
+            self.add_view(app_id, pid, workspace=(i % grid, (i // grid) % grid))
+
+    def add_view(self, app_id, pid, workspace=(0, 0)):
+        view_id = self.next_id
+        self.next_id += 1
+        ws_x, ws_y = workspace
+        view = {
+            "id": view_id,
+            "pid": pid,
+            "app-id": app_id,
+            "title": "{0} window {1}".format(app_id, view_id),
+            "role": "toplevel",
+            "mapped": True,
+            "type": "toplevel",
+            "layer": "workspace",
+            "output-id": self.output["id"],
+            "output-name": self.output["name"],
+            "geometry": {
+                "x": ws_x * OUTPUT_WIDTH + 100 + view_id % 50,
+                "y": ws_y * OUTPUT_HEIGHT + 100,
+                "width": 800,
+                "height": 600,
+            },
+            "minimized": False,
+            "sticky": False,
+            "always-on-top": False,
+            "fullscreen": False,
+            "activated": False,
+            "focusable": True,
+            "last-focus-timestamp": view_id,
+            "wset-index": 1,
+        }
+        self.views[view_id] = view
+        self.focused = view_id
+        return view
+
+    # requests
+
+    def handle(self, msg):
+        method = msg["method"]
+        data = msg.get("data", {})
+        view = self.views.get(data.get("view_id", data.get("view-id", data.get("id"))))
+
+        if method == "window-rules/list-views":
+            return list(self.views.values())
+        if method == "window-rules/view-info":
+            if view is None:
+                return {"error": "no such view"}
+            return {"info": view}
+        if method == "window-rules/get-focused-view":
+            return {"info": self.views.get(self.focused)}
+        if method == "window-rules/get-focused-output":
+            return {"info": self.output}
+        if method == "window-rules/output-info":
+            # unlike the focused lookups, the compositor answers with the output itself
+            return self.output
+        if method == "window-rules/list-outputs":
+            return [self.output]
+        if method == "window-rules/configure-view":
+            if view is None:
+                return {"error": "no such view"}
+            view["geometry"] = dict(data["geometry"])
+            self.emit("view-geometry-changed", view=view)
+            return {"result": "ok"}
+        if method == "window-rules/focus-view":
+            if view is not None:
+                self.focused = view["id"]
+                self.emit("view-focused", view=view)
+            return {"result": "ok"}
+        if method == "wm-actions/set-minimized":
+            if view is not None:
+                view["minimized"] = bool(data["state"])
+                self.emit("view-minimized", view=view)
+            return {"result": "ok"}
+        if method == "wm-actions/set-sticky":
+            if view is not None:
+                view["sticky"] = bool(data["state"])
+            return {"result": "ok"}
+        if method == "wm-actions/set-always-on-top":
+            if view is not None:
+                view["always-on-top"] = bool(data["state"])
+            return {"result": "ok"}
+        if method == "vswitch/set-workspace":
+            workspace = data.get("x"), data.get("y")
+            if isinstance(data.get("workspace"), dict):
+                workspace = data["workspace"].get("x"), data["workspace"].get("y")
+            if view is not None and None not in workspace:
+                view["geometry"]["x"] = workspace[0] * OUTPUT_WIDTH + 100
+                view["geometry"]["y"] = workspace[1] * OUTPUT_HEIGHT + 100
+                self.emit("view-workspace-changed", view=view)
+            return {"result": "ok"}
+        if method == "view-shot/capture":
+            if view is None:
+                return {"error": "no such view"}
+            with open(data["file"], "wb") as f:
+                f.write(PNG_1X1)
+            return {"result": "ok"}
+        if method in ("stipc/run", "stipc/run_cmd"):
+            pid = self.next_pid
+            self.next_pid += 1
+            app_id = os.path.basename(data.get("cmd", "app").split()[0])
+            timer = threading.Timer(self.MAP_DELAY, self.map_launched, (app_id, pid))
+            timer.daemon = True
+            timer.start()
+            return {"result": "ok", "pid": pid}
+        # grid slots, move_cursor, dpms and anything else only need an ok
+        return {"result": "ok"}
+
+    def map_launched(self, app_id, pid):
+        with self.lock:
+            view = self.add_view(app_id, pid)
+        self.emit("view-mapped", view=view)
+
+    # events
+
+    def emit(self, event, **fields):
+        message = dict(fields, event=event)
+        for conn, events in list(self.watchers.items()):
+            if events is None or event in events:
+                try:
+                    self.send(conn, message)
+                except OSError:
+                    self.watchers.pop(conn, None)
+
+    # protocol
+
+    def send(self, conn, message):
+        data = json.dumps(message).encode()
+        conn.sendall(len(data).to_bytes(4, byteorder="little") + data)
+
+    def read(self, conn, n):
+        data = bytearray()
+        while len(data) < n:
+            chunk = conn.recv(n - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return bytes(data)
+
+    def serve_client(self, conn):
+        try:
+            while True:
+                length = int.from_bytes(self.read(conn, 4), byteorder="little")
+                msg = json.loads(self.read(conn, length))
+                if self.LATENCY:
+                    time.sleep(self.LATENCY)
+                with self.lock:
+                    self.requests[msg["method"]] += 1
+                    if msg["method"] == "window-rules/events/watch":
+                        events = msg.get("data", {}).get("events")
+                        reply = {"result": "ok"}
+                    else:
+                        events = False
+                        reply = self.handle(msg)
+                    self.send(conn, reply)
+                    if events is not False:
+                        self.watchers[conn] = set(events) if events else None
+        except (EOFError, OSError):
+            pass
+        finally:
+            self.watchers.pop(conn, None)
+            conn.close()
+
+    def serve_forever(self):
+        while True:
+            conn, _ = self.server.accept()
+            threading.Thread(target=self.serve_client, args=(conn,), daemon=True).start()
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(64)
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def reset_counts(self):
+        with self.lock:
+            self.requests.clear()
+
+    def round_trips(self):
+        with self.lock:
+            return sum(self.requests.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("socket", help="path of the unix socket to listen on")
+    parser.add_argument("--views", type=int, default=10, help="number of views on the fake desktop")
+    parser.add_argument("--latency", type=float, default=0.0, help="milliseconds every request is delayed")
+    parser.add_argument("--map-delay", type=float, default=0.0, help="milliseconds before a launched app maps")
+    args = parser.parse_args()
+
+    fake = FakeWayfire(args.socket, args.views, args.latency / 1000.0, args.map_delay / 1000.0).start()
+    print("fake wayfire with {0} views on {1}".format(args.views, args.socket))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
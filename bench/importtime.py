@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Check that the hot wayctl subcommands stay within their import budget.
+
+Every subcommand below is run through `python -X importtime wayctl.py ...` and
+the check fails if it imports one of the heavy modules or if the total import
+time goes over the budget. Point WAYFIRE_SOCKET at a live (or fake) compositor
+so the command paths are exercised past the connection; the daemon is always
+bypassed so the cold start is what gets measured.
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+WAYCTL = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "wayctl.py")
+
+HEAVY = ("PIL", "dbus", "psutil", "numpy", "asyncio")
+
+# (subcommand, import budget in milliseconds, modules that must never load)
+BUDGETS = [
+    (["--help"], 80, HEAVY),
+    (["--move_cursor", "10", "10"], 80, HEAVY),
+    (["--view", "focused"], 80, HEAVY),
+    (["--view", "list"], 80, HEAVY),
+    (["--output", "focused"], 80, HEAVY),
+    (["--dpms", "on", "all"], 80, HEAVY),
+]
+
+
+def import_profile(argv):
+    env = dict(os.environ, WAYCTL_SOCKET=os.devnull + ".wayctl-bench")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", WAYCTL] + argv,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        env=env,
+        text=True,
+    )
+    modules = {}
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # only top level entries, nested ones are already in their parent's cumulative time
+        if not name.startswith("  "):
+            total_us += int(cumulative)
+        modules[name.strip()] = int(cumulative)
+    return modules, total_us / 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=float(os.getenv("WAYCTL_IMPORT_BUDGET_SCALE", "1")),
+        help="multiply every budget, for slow machines or CI runners",
+    )
+    args = parser.parse_args()
+
+    failed = 0
+    for argv, budget, forbidden in BUDGETS:
+        modules, total = import_profile(argv)
+        budget *= args.scale
+        loaded = sorted(
+            name for name in modules if name.split(".")[0] in forbidden
+        )
+        status = "ok"
+        if loaded:
+            status = "FAIL loaded {0}".format(", ".join(loaded))
+        elif total > budget:
+            status = "FAIL over budget"
+        if status != "ok":
+            failed += 1
+        print("{0:<32} {1:7.1f} ms / {2:5.0f} ms  {3}".format(" ".join(argv), total, budget, status))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Benchmark wayctl commands against the fake Wayfire IPC server and compare with a baseline.
+
+Every scenario runs `wayctl.py` as a fresh process, the way a keybinding does,
+with WAYFIRE_SOCKET pointing at bench/fakewayfire.py and the daemon and state
+cache bypassed. For each scenario and desktop size the p50/p99 wall time, the
+IPC round trips of one run and the peak RSS are reported, and checked against
+bench/baseline.json: more round trips than the baseline always fail, memory
+fails past the tolerance. Wall times are reported but only checked with
+--check-time, they vary by tens of milliseconds between runs and machines, so
+record the baseline with --update-baseline on the machine that checks them.
+The commands' viewers and clipboard tools are replaced by no-ops, and
+`--screenshot view all` still writes /tmp/screenshots.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from fakewayfire import FakeWayfire
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WAYCTL = os.path.join(HERE, os.pardir, "wayctl.py")
+BASELINE = os.path.join(HERE, "baseline.json")
+
+# programs the commands hand their results to, replaced by no-ops
+STUBS = ("xdg-open", "wl-copy", "grim", "slurp")
+
+
+def prepare_session(fake, home):
+    # a session with every fake view, restored by launching each cmdline through stipc
+    path = os.path.join(home, ".config", "wayfire-session.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(json.dumps({"wayctl-session": 2}) + "\n")
+        for view in fake.views.values():
+            record = dict(view, cmdline=[view["app-id"]], workspace={"x": 0, "y": 0})
+            f.write(json.dumps(record) + "\n")
+
+
+# (name, wayctl arguments, setup before every run)
+SCENARIOS = [
+    ("cold-start", ["--view", "focused"], None),
+    ("view-list", ["--view", "list", "format", "ndjson"], None),
+    ("session-save", ["--session", "save"], None),
+    ("session-restore", ["--session", "start", "timeout", "5"], prepare_session),
+    ("drop-toggle", ["--drop", "kitty"], None),
+    ("screenshot-views", ["--screenshot", "view", "all"], None),
+]
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(p / 100.0 * (len(samples) - 1))))]
+
+
+# runs wayctl.py as __main__ and records its peak rss on exit. ru_maxrss would
+# carry over the benchmark's own peak through fork and exec, VmHWM starts fresh
+BOOTSTRAP = """
+import atexit, os, runpy, sys
+
+def record_peak():
+    with open("/proc/self/status") as status, open(os.environ["WAYCTL_BENCH_PEAK"], "w") as out:
+        out.write(next(line.split()[1] for line in status if line.startswith("VmHWM:")))
+
+atexit.register(record_peak)
+sys.argv = sys.argv[1:]
+# like running the script, its directory comes first on sys.path for wayctl_core
+sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[0])))
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+def run_once(argv, env):
+    peak_path = os.path.join(env["HOME"], "peak")
+    env = dict(env, WAYCTL_BENCH_PEAK=peak_path)
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-c", BOOTSTRAP, WAYCTL] + argv,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        env=env,
+    )
+    elapsed = time.perf_counter() - started
+    with open(peak_path) as f:
+        peak = int(f.read())
+    return elapsed, peak, proc.returncode, proc.stderr.decode(errors="replace")
+
+
+def run_scenario(name, argv, setup, views, runs, latency, workdir):
+    path = os.path.join(workdir, "wayfire-{0}-{1}.socket".format(name, views))
+    home = os.path.join(workdir, "home-{0}-{1}".format(name, views))
+    os.makedirs(os.path.join(home, ".config"))
+    env = dict(
+        os.environ,
+        WAYFIRE_SOCKET=path,
+        WAYCTL_SOCKET=os.path.join(workdir, "no-daemon.sock"),
+        WAYCTL_NO_CACHE="1",
+        HOME=home,
+        XDG_RUNTIME_DIR=home,
+        PATH=os.path.join(workdir, "bin") + os.pathsep + os.environ.get("PATH", ""),
+    )
+
+    times, rss, trips = [], [], []
+    for _ in range(runs):
+        # a fresh desktop per run, restores and toggles change it
+        fake = FakeWayfire(path, views, latency).start()
+        try:
+            if setup is not None:
+                setup(fake, home)
+            elapsed, maxrss, status, stderr = run_once(argv, env)
+            trips.append(fake.round_trips())
+        finally:
+            fake.stop()
+        if status != 0:
+            return {"error": stderr.strip().splitlines()[-1] if stderr.strip() else "exit {0}".format(status)}
+        times.append(elapsed * 1000)
+        rss.append(maxrss)
+    return {
+        "p50_ms": round(percentile(times, 50), 2),
+        "p99_ms": round(percentile(times, 99), 2),
+        "round_trips": max(trips),
+        "rss_kb": max(rss),
+    }
+
+
+def compare(result, baseline, tolerance, slack, check_time=False):
+    if "error" in result:
+        return "FAIL {0}".format(result["error"])
+    if baseline is None:
+        return "new"
+    if result["round_trips"] > baseline["round_trips"]:
+        return "FAIL round trips {0} > {1}".format(result["round_trips"], baseline["round_trips"])
+    if check_time and result["p50_ms"] > baseline["p50_ms"] * tolerance + slack:
+        return "FAIL p50 over {0:.1f} ms".format(baseline["p50_ms"] * tolerance + slack)
+    if result["rss_kb"] > baseline["rss_kb"] * max(tolerance, 1.25):
+        return "FAIL rss over {0:.0f} kB".format(baseline["rss_kb"] * max(tolerance, 1.25))
+    return "ok"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--views", default="10,100,1000", help="comma separated desktop sizes")
+    parser.add_argument("--runs", type=int, default=10, help="runs per scenario and size")
+    parser.add_argument("--latency", type=float, default=0.0, help="milliseconds the fake compositor takes per request")
+    parser.add_argument("--only", help="comma separated scenario names")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=float(os.getenv("WAYCTL_BENCH_TOLERANCE", "1.5")),
+        help="fail when rss, or p50 with --check-time, exceeds the baseline times this factor",
+    )
+    parser.add_argument(
+        "--slack",
+        type=float,
+        default=float(os.getenv("WAYCTL_BENCH_SLACK", "25")),
+        help="milliseconds allowed on top of the tolerance, for process start jitter",
+    )
+    parser.add_argument(
+        "--check-time",
+        action="store_true",
+        help="also fail on p50 wall time, only meaningful against a baseline recorded on this machine",
+    )
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the new baseline")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+
+    only = set(args.only.split(",")) if args.only else None
+    workdir = tempfile.mkdtemp(prefix="wayctl-bench-")
+    os.makedirs(os.path.join(workdir, "bin"))
+    for stub in STUBS:
+        stub_path = os.path.join(workdir, "bin", stub)
+        with open(stub_path, "w") as f:
+            f.write("#!/bin/sh\nexit 0\n")
+        os.chmod(stub_path, 0o755)
+
+    results = {}
+    failed = 0
+    try:
+        for name, argv, setup in SCENARIOS:
+            if only and name not in only:
+                continue
+            for views in (int(n) for n in args.views.split(",")):
+                key = "{0}/{1}".format(name, views)
+                result = run_scenario(name, argv, setup, views, args.runs, args.latency / 1000.0, workdir)
+                results[key] = result
+                status = compare(result, baseline.get(key), args.tolerance, args.slack, args.check_time)
+                if status.startswith("FAIL"):
+                    failed += 1
+                if "error" in result:
+                    print("{0:<24} {1}".format(key, status))
+                    continue
+                print(
+                    "{0:<24} p50 {1:8.1f} ms  p99 {2:8.1f} ms  {3:5d} rt  {4:7d} kB  {5}".format(
+                        key, result["p50_ms"], result["p99_ms"], result["round_trips"], result["rss_kb"], status
+                    )
+                )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.update_baseline:
+        baseline.update({key: result for key, result in results.items() if "error" not in result})
+        with open(BASELINE, "w") as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+            f.write("\n")
+        print("baseline updated: {0}".format(BASELINE))
+        return 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3333 @@
+"""The wayctl commands, the daemon and the compositor clients they use.
+
+wayctl.py forwards a command line to a running daemon and imports this module
+only when it runs the command itself. Unlike the script, an imported module is
+cached as bytecode, so that path does not recompile it on every call.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+
+# start of the import phase, reported by --trace
+IMPORT_STARTED = time.perf_counter()
+
+import io
+import re
+import mmap
+import struct
+import pprint
+import argparse
+import shutil
+import contextlib
+import traceback
+import select
+import threading
+import builtins
+from subprocess import call, check_output, Popen
+import subprocess as s
+from wayfire.ipc import *
+from wayfire.extra.ipc_utils import WayfireUtils
+from wayfire.extra.stipc import Stipc
+from wayctl import DAEMON_SOCKET, daemon_forwardable
+
+IMPORT_FINISHED = time.perf_counter()
+
+# PIL, psutil and dbus are imported inside the few commands that need them,
+# and the compositor connection is opened on first use, so hot keybindings
+# like --move_cursor or --view focused start as fast as possible
+sock = stipc = ws_utils = None
+
+# session files are JSON lines behind a {"wayctl-session": SESSION_VERSION} header,
+# files without the header are the old indent=4 blobs joined by LEGACY_SEPARATOR
+SESSION_VERSION = 2
+LEGACY_SEPARATOR = "\n--------view--------\n"
+
+
+# the daemon mirrors compositor state here for read-only commands, see StateCache
+STATE_FILE = os.path.splitext(DAEMON_SOCKET)[0] + ".state"
+# magic, generation (odd while the state is being replaced), payload length, writer pid
+STATE_HEADER = struct.Struct("<8sQQQ")
+STATE_MAGIC = b"wayctl1\0"
+# a batch mixes writes and reads, it must not read state older than its own writes
+use_state_cache = not os.getenv("WAYCTL_NO_CACHE")
+
+# the active Tracer while a command runs with --trace or WAYCTL_TRACE, None otherwise
+tracer = None
+
+# the daemon's Scheduler, commands run by the daemon hand it their delayed work, None elsewhere
+scheduler = None
+
+
+def connect():
+    global sock, stipc, ws_utils
+    sock = WayfireSocket(os.getenv("WAYFIRE_SOCKET"))
+    stipc = Stipc(sock)
+    ws_utils = WayfireUtils(sock)
+    if tracer is not None:
+        tracer.wrap_connection()
+    return sock
+
+
+def get_sock():
+    if sock is None:
+        connect()
+    return sock
+
+
+def disconnect():
+    global sock
+    if sock is not None:
+        sock.close()
+        sock = None
+
+
+class TracedProxy:
+    """Forward everything to the wrapped object, timing each method call."""
+
+    def __init__(self, target, prefix):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_prefix", prefix)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value) or name.startswith("_"):
+            return value
+        label = "{0}.{1}".format(self._prefix, name)
+
+        def traced(*args, **kwargs):
+            with tracer.measure(label, "call"):
+                return value(*args, **kwargs)
+
+        return traced
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+    def __delattr__(self, name):
+        delattr(self._target, name)
+
+
+class TracedPopen(s.Popen):
+    """Popen recording the spawn and the wait of every child as trace spans."""
+
+    def __init__(self, args, *rest, **kwargs):
+        self._trace_name = os.path.basename(args if isinstance(args, str) else str(args[0])).split()[0]
+        self._trace_waiting = False
+        with tracer.measure("spawn " + self._trace_name, "subprocess", argv=str(args)):
+            super().__init__(args, *rest, **kwargs)
+
+    def communicate(self, *args, **kwargs):
+        self._trace_waiting = True
+        try:
+            with tracer.measure("wait " + self._trace_name, "subprocess"):
+                return super().communicate(*args, **kwargs)
+        finally:
+            self._trace_waiting = False
+
+    def wait(self, *args, **kwargs):
+        if self._trace_waiting or tracer is None:
+            return super().wait(*args, **kwargs)
+        with tracer.measure("wait " + self._trace_name, "subprocess"):
+            return super().wait(*args, **kwargs)
+
+
+class Tracer:
+    """Record a timeline of IPC calls, subprocesses, sleeps and imports for one command.
+
+    Nothing is patched until a tracer is entered, so a command without --trace
+    only pays for the `tracer is not None` checks in connect and send_pipelined.
+    Spans use time.perf_counter, the monotonic clock, so traces of the client
+    and of the daemon line up in one viewer.
+    """
+
+    # the import phase is reported once per process
+    imports_reported = False
+
+    def __init__(self, mode):
+        self.mode = mode # "summary" or the path of a chrome trace file
+        self.events = []
+        self.patched = []
+
+    def span(self, name, cat, start, end, **args):
+        self.events.append(
+            {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_native_id(),
+                "args": args,
+            }
+        )
+
+    @contextlib.contextmanager
+    def measure(self, name, cat, **args):
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.span(name, cat, start, time.perf_counter(), **args)
+
+    def patch(self, owner, name, value):
+        self.patched.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, value)
+
+    def traced_send_json(self, send_json):
+        def send(msg):
+            request = json.dumps(msg)
+            with self.measure("ipc " + msg.get("method", "?"), "ipc", request_bytes=len(request)) as args:
+                reply = send_json(msg)
+                args["reply_bytes"] = len(json.dumps(reply))
+                return reply
+
+        return send
+
+    def wrap_connection(self):
+        global sock, stipc, ws_utils
+        if sock is None or isinstance(sock, TracedProxy):
+            return
+        self.raw_connection = (sock, stipc, ws_utils)
+        # an override already on the instance (a batch's) is put back when the trace ends
+        self.raw_send_json = sock.__dict__.get("send_json")
+        # instance attribute, pywayfire, stipc and ws_utils all go through it
+        sock.send_json = self.traced_send_json(sock.send_json)
+        sock = TracedProxy(sock, "sock")
+        stipc = TracedProxy(stipc, "stipc")
+        ws_utils = TracedProxy(ws_utils, "ws_utils")
+
+    def unwrap_connection(self):
+        global sock, stipc, ws_utils
+        if not hasattr(self, "raw_connection"):
+            return
+        raw_sock = self.raw_connection[0]
+        if sock is not None:
+            sock, stipc, ws_utils = self.raw_connection
+        if self.raw_send_json is not None:
+            raw_sock.send_json = self.raw_send_json
+        else:
+            with contextlib.suppress(AttributeError):
+                del raw_sock.send_json
+
+    def traced_import(self, original):
+        def traced(name, globals=None, locals=None, fromlist=(), level=0):
+            top = name.split(".")[0]
+            # relative imports happen inside a package whose import is already measured
+            if level or not name or top in sys.modules:
+                return original(name, globals, locals, fromlist, level)
+            with self.measure("import " + top, "import"):
+                return original(name, globals, locals, fromlist, level)
+
+        return traced
+
+    def traced_sleep(self, original):
+        def traced(seconds):
+            with self.measure("sleep", "sleep", seconds=seconds):
+                original(seconds)
+
+        return traced
+
+    def __enter__(self):
+        global tracer
+        tracer = self
+        if not Tracer.imports_reported:
+            Tracer.imports_reported = True
+            self.span("import wayctl", "import", IMPORT_STARTED, IMPORT_FINISHED)
+        self.patch(builtins, "__import__", self.traced_import(builtins.__import__))
+        self.patch(time, "sleep", self.traced_sleep(time.sleep))
+        self.patch(s, "Popen", TracedPopen)
+        self.patch(sys.modules[__name__], "Popen", TracedPopen)
+        self.wrap_connection()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        global tracer
+        self.span("command", "command", self.started, time.perf_counter())
+        self.unwrap_connection()
+        for owner, name, value in reversed(self.patched):
+            setattr(owner, name, value)
+        tracer = None
+        if self.mode == "summary":
+            self.write_summary(sys.stderr)
+        else:
+            self.write_chrome(self.mode)
+
+    def write_chrome(self, path):
+        # the JSON array format may stay unterminated, so a daemon can keep appending
+        with open(path, "a") as f:
+            if f.tell() == 0:
+                f.write("[\n")
+            for event in self.events:
+                f.write(json.dumps(event, separators=(",", ":")) + ",\n")
+
+    def write_summary(self, out):
+        totals = {}
+        for event in self.events:
+            key = (event["cat"], event["name"])
+            count, total, longest = totals.get(key, (0, 0.0, 0.0))
+            totals[key] = (count + 1, total + event["dur"], max(longest, event["dur"]))
+        out.write("{0:<10} {1:<40} {2:>6} {3:>10} {4:>10}\n".format("category", "name", "count", "total ms", "max ms"))
+        for (cat, name), (count, total, longest) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            out.write("{0:<10} {1:<40} {2:>6} {3:>10.2f} {4:>10.2f}\n".format(cat, name[:40], count, total / 1000, longest / 1000))
+
+
+def send_pipelined(sock, messages):
+    """Write every request before reading any reply, returns the replies in order.
+
+    A failed request gives its exception in place of the reply instead of
+    aborting the ones behind it. Inside a batch the requests go through the
+    batch, behind the writes it has queued.
+    """
+    batched = sock.__dict__.get("send_pipelined")
+    if batched is not None:
+        return batched(messages)
+    return send_pipelined_live(sock, messages)
+
+
+def send_pipelined_live(sock, messages):
+    if tracer is not None:
+        with tracer.measure("ipc pipelined", "ipc", requests=len(messages)):
+            return send_pipelined_untraced(sock, messages)
+    return send_pipelined_untraced(sock, messages)
+
+
+def send_pipelined_untraced(sock, messages):
+    payload = bytearray()
+    for msg in messages:
+        data = json.dumps(msg).encode("utf-8")
+        payload += len(data).to_bytes(4, byteorder="little") + data
+    sock.client.sendall(payload)
+
+    replies = []
+    while len(replies) < len(messages):
+        try:
+            reply = sock.read_message()
+        except Exception as e:
+            # read_message consumed the whole error reply, the stream is still in sync
+            replies.append(e)
+            continue
+        if "event" in reply:
+            sock.pending_events.append(reply)
+            continue
+        replies.append(reply)
+    return replies
+
+
+def read_state(path=STATE_FILE):
+    """Return the cached compositor state, or None when it is missing, being replaced or orphaned."""
+    if not use_state_cache:
+        return None
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            magic, generation, length, pid = STATE_HEADER.unpack_from(m)
+            if magic != STATE_MAGIC or generation % 2 or STATE_HEADER.size + length > len(m):
+                return None
+            data = m[STATE_HEADER.size:STATE_HEADER.size + length]
+            # the writer bumped the generation while we copied, the copy may be torn
+            if STATE_HEADER.unpack_from(m)[1] != generation:
+                return None
+    except (OSError, ValueError, struct.error):
+        return None
+    try:
+        # a daemon that died leaves a state nobody keeps current anymore
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+    return json.loads(data)
+
+
+class StateCache:
+    """Mirror views, outputs and focus into a memory mapped file, replaced after every compositor event.
+
+    The generation in the header is odd from the moment an event arrives until
+    the new state is written, readers fall back to a live query meanwhile.
+    The daemon also calls stale() after a command that may have changed the
+    compositor, so the next command can't read a state from before its own
+    write while the matching event is still on its way.
+    """
+
+    EVENTS = [
+        "view-focused",
+        "view-mapped",
+        "view-unmapped",
+        "view-geometry-changed",
+        "view-set-output",
+        "view-title-changed",
+        "view-minimized",
+        "view-sticky",
+        "view-always-on-top",
+        "view-fullscreen",
+        "view-workspace-changed",
+        "wset-workspace-changed",
+        "output-added",
+        "output-removed",
+        "output-gain-focus",
+    ]
+
+    def __init__(self, path=STATE_FILE):
+        self.path = path
+        self.generation = 0
+        self.map = None
+        # stale() comes from the daemon's thread, the header is only changed under the lock
+        self.lock = threading.Lock()
+        self.writes = 0 # bumped by every stale(), a snapshot taken before it is thrown away
+        self.wakeup_read, self.wakeup_write = os.pipe()
+
+    def stale(self):
+        with self.lock:
+            self.writes += 1
+            if self.map is not None:
+                self.invalidate()
+        os.write(self.wakeup_write, b"\0")
+
+    def open(self):
+        tmp_path = "{0}.{1}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(STATE_HEADER.pack(STATE_MAGIC, 1, 0, os.getpid()))
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.path)
+        self.file = open(self.path, "r+b")
+        with self.lock:
+            self.map = mmap.mmap(self.file.fileno(), 0)
+            self.generation = 1
+
+    def set_generation(self, generation, length=None):
+        self.generation = generation
+        if length is None:
+            length = STATE_HEADER.unpack_from(self.map)[2]
+        STATE_HEADER.pack_into(self.map, 0, STATE_MAGIC, generation, length, os.getpid())
+
+    def invalidate(self):
+        if self.generation % 2 == 0:
+            self.set_generation(self.generation + 1)
+
+    def write(self, state, writes=None):
+        """Publish state, unless stale() was called since it was taken (writes is the count from before)."""
+        data = json.dumps(state, separators=(",", ":")).encode()
+        size = STATE_HEADER.size + len(data)
+        with self.lock:
+            if writes is not None and writes != self.writes:
+                return False
+            if size > len(self.map):
+                # only ever grown, shrinking would SIGBUS a reader still mapping the old size
+                self.map.resize(max(size, 2 * len(self.map)))
+            self.invalidate()
+            self.map[STATE_HEADER.size:size] = data
+            self.set_generation(self.generation + 1, len(data))
+        return True
+
+    def snapshot(self, sock):
+        requests = [
+            get_msg_template("window-rules/list-views"),
+            get_msg_template("window-rules/list-outputs"),
+            get_msg_template("window-rules/get-focused-view"),
+            get_msg_template("window-rules/get-focused-output"),
+        ]
+        views, outputs, focused_view, focused_output = send_pipelined(sock, requests)
+        for reply in (views, outputs, focused_view, focused_output):
+            if isinstance(reply, Exception):
+                raise reply
+        return {
+            "views": views,
+            "outputs": outputs,
+            "focused-view": focused_view.get("info"),
+            "focused-output": focused_output.get("info"),
+        }
+
+    def run(self):
+        self.open()
+        # the refresh connection is separate from the daemon's, this runs in its own thread
+        sock = WayfireSocket(os.getenv("WAYFIRE_SOCKET"))
+        try:
+            with EventWatcher(self.EVENTS) as watcher:
+                while True:
+                    writes = self.writes
+                    if not self.write(self.snapshot(sock), writes):
+                        # a command wrote to the compositor meanwhile, this snapshot may predate it
+                        continue
+                    if not watcher.sock.pending_events:
+                        select.select([watcher.sock.client, self.wakeup_read], [], [])
+                    with self.lock:
+                        self.invalidate()
+                    os.set_blocking(self.wakeup_read, False)
+                    try:
+                        os.read(self.wakeup_read, 4096)
+                    except BlockingIOError:
+                        pass
+                    # replace the state once per burst, not once per event
+                    while watcher.next_event(0) is not None:
+                        pass
+        finally:
+            sock.close()
+            self.close()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+async def set_dpms(state, names):
+    """Switch the named outputs on, off or toggle them with wlopm, all at once."""
+    import asyncio
+
+    procs = [await asyncio.create_subprocess_exec("wlopm", "--" + state, name) for name in names]
+    await asyncio.gather(*(proc.wait() for proc in procs))
+
+
+class EventWatcher:
+    """A second compositor connection subscribed to events, so the main one stays free for requests."""
+
+    def __init__(self, events):
+        self.sock = WayfireSocket(os.getenv("WAYFIRE_SOCKET"))
+        self.sock.watch(list(events))
+
+    def next_event(self, timeout=None):
+        # events that arrived while waiting for the watch reply are queued here
+        if self.sock.pending_events:
+            return self.sock.pending_events.pop(0)
+        if timeout is not None:
+            readable, _, _ = select.select([self.sock.client], [], [], max(timeout, 0))
+            if not readable:
+                return None
+        return self.sock.read_message()
+
+    def events(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            event = self.next_event(deadline - time.monotonic())
+            if event is None:
+                return
+            yield event
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ViewDropDown:
+    def __init__(self, term, timeout=5) -> None:
+        pass
+
+        self.TERMINAL_CMD = term
+        self.TERMINAL_WIDTH = 1000
+        self.TERMINAL_HEIGHT = 600
+        self.VIEW_STICKY = True # show the terminal in all workspaces, set False to disable
+        self.VIEW_ALWAYS_ON_TOP = True # always on top even if another view get the focus, Set False to disable
+        self.MAP_TIMEOUT = timeout # seconds to wait for a new terminal to show up
+
+        # the id of the last drop down view, so a toggle is a single view-info request
+        self.state_file = os.path.join(
+            os.getenv("XDG_RUNTIME_DIR", "/tmp"),
+            "wayctl-drop-{0}".format(os.path.basename(term.split()[0])),
+        )
+
+    @property
+    def sock(self):
+        return get_sock()
+
+    def is_terminal(self, view):
+        return view is not None and view['app-id'].lower() == self.TERMINAL_CMD
+
+    def remember_view(self, view):
+        with open(self.state_file, "w") as f:
+            f.write(str(view['id']))
+
+    def remembered_view(self):
+        try:
+            with open(self.state_file) as f:
+                view_id = int(f.read())
+        except (OSError, ValueError):
+            return None
+        try:
+            view = self.sock.get_view(view_id)
+        except Exception:
+            # the view is gone, wayfire answers with an error
+            return None
+        if self.is_terminal(view):
+            return view
+        return None
+
+    def find_view(self):
+        view = self.remembered_view()
+        if view is not None:
+            if view['minimized']:
+                return view, None
+            return None, view
+
+        hidden_view = shown_view = None
+        state = read_state()
+        views = state["views"] if state is not None else self.sock.list_views()
+        for v in views:
+            if self.is_terminal(v):
+                if v['minimized']:
+                    hidden_view = v
+                else:
+                    shown_view = v
+        if hidden_view or shown_view:
+            self.remember_view(shown_view or hidden_view)
+        return hidden_view, shown_view
+
+    def wait_for_view(self, watcher):
+        for event in watcher.events(self.MAP_TIMEOUT):
+            view = event.get("view")
+            if event.get("event") == "view-mapped" and self.is_terminal(view):
+                return view
+        return None
+
+    def configure_view(self, view, output):
+        if self.TERMINAL_WIDTH == 0 or self.TERMINAL_HEIGHT == 0:
+            return
+        wa = output['workarea']
+        geom = view['geometry']
+        x = wa['x'] + wa['width'] // 2 - geom['width'] // 2
+        y = wa['y'] + wa['height'] // 2 - geom['height'] // 2
+        self.sock.configure_view(view["id"], x, y, self.TERMINAL_WIDTH, self.TERMINAL_HEIGHT)
+        self.sock.set_view_sticky(view["id"], self.VIEW_STICKY)
+        self.sock.set_view_always_on_top(view["id"], self.VIEW_ALWAYS_ON_TOP)
+
+    def show_view(self, hidden_view):
+        self.sock.set_view_minimized(hidden_view['id'], False)
+        self.configure_view(hidden_view, self.sock.get_focused_output())
+
+    def hide_view(self, shown_view):
+        self.sock.set_view_minimized(shown_view['id'], True)
+
+
+    def run(self):
+        hidden_view, shown_view = self.find_view()
+        if not shown_view and not hidden_view:
+            if scheduler is not None:
+                # in the daemon, waiting for the new terminal to map would hold up every other client
+                raise RunLocally("--drop has to start {0}".format(self.TERMINAL_CMD))
+            # subscribe before spawning so a fast terminal cannot map unnoticed
+            with EventWatcher(["view-mapped"]) as watcher:
+                Popen(self.TERMINAL_CMD, start_new_session=True)
+                shown_view = self.wait_for_view(watcher)
+            if shown_view:
+                self.remember_view(shown_view)
+                self.show_view(shown_view)
+            else:
+                print("Failed to start new terminal!")
+        elif shown_view:
+            self.hide_view(shown_view)
+        else:
+            self.show_view(hidden_view)
+
+
+class EventStream:
+    """Stream compositor events as NDJSON, coalescing the ones a slow reader has not taken yet."""
+
+    EVENTS = [
+        "view-focused",
+        "view-mapped",
+        "view-unmapped",
+        "view-geometry-changed",
+        "view-set-output",
+        "view-title-changed",
+        "view-minimized",
+        "view-workspace-changed",
+        "wset-workspace-changed",
+        "output-added",
+        "output-removed",
+        "output-gain-focus",
+    ]
+    # only the latest of these matters per view, a resize sends one per frame
+    COALESCED = ("view-geometry-changed", "view-title-changed")
+
+    def __init__(self, events=None, app_id=None, output=None, queue=1024, out=None):
+        self.events = events or self.EVENTS
+        self.app_id = app_id.lower() if app_id else None
+        self.output = output
+        self.QUEUE = queue # events held for a slow reader before the oldest are dropped
+        self.out = out if out is not None else sys.stdout
+        self.queue = {}
+        self.seq = 0
+        self.dropped = 0
+        self.buffer = bytearray()
+
+    def wanted(self, event):
+        view = event.get("view") or {}
+        if self.app_id is not None and view.get("app-id", "").lower() != self.app_id:
+            return False
+        if self.output is not None:
+            outputs = {
+                view.get("output-name"),
+                view.get("output-id"),
+                event.get("output"),
+                (event.get("output-data") or {}).get("name"),
+            }
+            if self.output not in {str(o) for o in outputs if o is not None}:
+                return False
+        return True
+
+    def push(self, event):
+        event["ts"] = time.monotonic()
+        view = event.get("view")
+        if event["event"] in self.COALESCED and view is not None:
+            key = (event["event"], view["id"])
+            if key in self.queue:
+                # keep the queue position of the first one, with the latest state
+                self.queue[key] = event
+                return
+        else:
+            key = self.seq
+        self.seq += 1
+        self.queue[key] = event
+        if len(self.queue) > self.QUEUE:
+            del self.queue[next(iter(self.queue))]
+            self.dropped += 1
+
+    def fill(self):
+        if self.dropped:
+            self.buffer += json.dumps(
+                {"event": "wayctl-dropped", "count": self.dropped, "ts": time.monotonic()},
+                separators=(",", ":"),
+            ).encode() + b"\n"
+            self.dropped = 0
+        for event in self.queue.values():
+            self.buffer += json.dumps(event, separators=(",", ":")).encode() + b"\n"
+        self.queue.clear()
+
+    def run(self):
+        self.out.flush()
+        fd = self.out.fileno()
+        # a full pipe must not block reading events, they would pile up in the compositor
+        os.set_blocking(fd, False)
+        try:
+            with EventWatcher(self.events) as watcher:
+                while True:
+                    waiting = [fd] if self.buffer or self.queue else []
+                    readable, writable, _ = select.select([watcher.sock.client], waiting, [])
+                    if readable or watcher.sock.pending_events:
+                        event = watcher.next_event(0)
+                        while event is not None:
+                            if "event" in event and self.wanted(event):
+                                self.push(event)
+                            event = watcher.next_event(0)
+                    if writable:
+                        if not self.buffer:
+                            self.fill()
+                        try:
+                            written = os.write(fd, self.buffer)
+                        except BlockingIOError:
+                            written = 0
+                        del self.buffer[:written]
+        except BrokenPipeError:
+            # the reader went away, like `wayctl --watch | head`
+            return
+        except KeyboardInterrupt:
+            return
+        finally:
+            with contextlib.suppress(OSError):
+                os.set_blocking(fd, True)
+
+
+class SessionRestore:
+    """Launch the saved session views concurrently and place each one as soon as it maps."""
+
+    def __init__(self, wayctl, views, parallel=8, timeout=30):
+        self.wayctl = wayctl
+        self.queue = [view for view in views if "workspace" in view]
+        self.PARALLEL = parallel # apps launched but not mapped yet at any time
+        self.TIMEOUT = timeout # seconds an app gets to map its first view
+        self.pending = {}
+        self.done = 0
+        self.failed = []
+
+    def report(self, view, status, started):
+        self.done += 1
+        print(
+            "[{0}/{1}] {2}: {3} ({4:.1f}s)".format(
+                self.done,
+                self.total,
+                view.get("app-id") or " ".join(view["cmdline"]),
+                status,
+                time.monotonic() - started,
+            )
+        )
+
+    def launch(self):
+        while self.queue and len(self.pending) < self.PARALLEL:
+            view = self.queue.pop(0)
+            started = time.monotonic()
+            try:
+                pid = self.wayctl.start_app(view["cmdline"])
+            except Exception as e:
+                pid = None
+                print("failed to start {0}: {1}".format(" ".join(view["cmdline"]), e))
+            if not pid:
+                self.failed.append(view)
+                self.report(view, "not started", started)
+                continue
+            self.pending[pid] = (view, started, started + self.TIMEOUT)
+
+    def match(self, mapped):
+        pid = mapped["pid"]
+        if pid in self.pending:
+            return pid
+
+        # apps started through a shell or a launcher map their view from a child
+        import psutil
+
+        try:
+            parents = [p.pid for p in psutil.Process(pid).parents()]
+        except (psutil.Error, ValueError):
+            parents = []
+        for parent in parents:
+            if parent in self.pending:
+                return parent
+
+        # single instance apps hand the window over to an already running process
+        for pending_pid, (view, _, _) in self.pending.items():
+            if view.get("app-id") and view["app-id"] == mapped["app-id"]:
+                return pending_pid
+        return None
+
+    def place(self, view_id, workspace):
+        self.wayctl.ws_utils.maximize(view_id)
+        self.wayctl.sock.set_workspace(workspace, view_id, self.output_id)
+        self.wayctl.ws_utils.maximize(view_id)
+
+    def expire(self):
+        now = time.monotonic()
+        for pid, (view, started, deadline) in list(self.pending.items()):
+            if now >= deadline:
+                del self.pending[pid]
+                self.failed.append(view)
+                self.report(view, "timed out", started)
+
+    def run(self):
+        self.total = len(self.queue)
+        self.output_id = self.wayctl.sock.get_focused_output()["id"]
+        start = time.monotonic()
+        # subscribe before the first launch so no view can map unnoticed
+        with EventWatcher(["view-mapped"]) as watcher:
+            self.launch()
+            while self.pending:
+                next_deadline = min(deadline for _, _, deadline in self.pending.values())
+                event = watcher.next_event(next_deadline - time.monotonic())
+                if event is not None and event.get("event") == "view-mapped":
+                    mapped = event["view"]
+                    pid = self.match(mapped)
+                    if pid is not None:
+                        view, started, _ = self.pending.pop(pid)
+                        self.place(mapped["id"], view["workspace"])
+                        self.report(
+                            view,
+                            "workspace {0},{1}".format(view["workspace"]["x"], view["workspace"]["y"]),
+                            started,
+                        )
+                self.expire()
+                self.launch()
+        print(
+            "session restored: {0} of {1} views in {2:.1f}s".format(
+                self.total - len(self.failed), self.total, time.monotonic() - start
+            )
+        )
+        return self.failed
+
+
+class SessionAutosave:
+    """Keep the session file current from compositor events, appending only the views that changed."""
+
+    EVENTS = [
+        "view-mapped",
+        "view-unmapped",
+        "view-geometry-changed",
+        "view-set-output",
+        "view-title-changed",
+        "view-minimized",
+        "view-workspace-changed",
+        "wset-workspace-changed",
+        "output-gain-focus",
+    ]
+
+    def __init__(self, wayctl, delay=2):
+        self.wayctl = wayctl
+        self.DELAY = delay # seconds to coalesce events before writing
+        self.path = wayctl.session_file()
+        self.records = {}
+        self.cmdlines = {}
+        self.journal = 0
+        self.reset()
+
+    def reset(self):
+        self.changed = {}
+        self.removed = set()
+        self.full = False
+        self.flush_at = None
+
+    def mark(self, event):
+        name = event.get("event")
+        view = event.get("view")
+        if name == "view-unmapped" and view is not None:
+            self.changed.pop(view["id"], None)
+            self.removed.add(view["id"])
+        elif view is not None:
+            # events carry the full view info, no need to ask the compositor again
+            self.changed[view["id"]] = view
+        else:
+            # the workspace or focused output moved, every view's workspace may differ
+            self.full = True
+        if self.flush_at is None:
+            self.flush_at = time.monotonic() + self.DELAY
+
+    def cmdline(self, pid):
+        if pid not in self.cmdlines:
+            self.cmdlines.update(self.wayctl.process_cmdlines([pid]))
+        return self.cmdlines.get(pid)
+
+    def snapshot(self):
+        self.output = self.wayctl.sock.get_focused_output()
+        views = self.wayctl.sock.list_views()
+        self.changed = {view["id"]: view for view in views}
+        self.removed = set(self.records) - set(self.changed)
+
+    def update(self):
+        if self.full:
+            self.snapshot()
+        workspaces = self.wayctl.view_workspaces(list(self.changed.values()), self.output)
+        lines = []
+        for view_id, view in self.changed.items():
+            cmdline = self.cmdline(view["pid"]) if view["pid"] > 0 else None
+            if cmdline is None:
+                continue
+            record = self.wayctl.session_record(view, cmdline, workspaces)
+            if self.records.get(view_id) != record:
+                self.records[view_id] = record
+                lines.append(record + "\n")
+        for view_id in self.removed:
+            if self.records.pop(view_id, None) is not None:
+                lines.append(json.dumps({"id": view_id, "removed": True}) + "\n")
+        self.reset()
+        return lines
+
+    def flush(self):
+        lines = self.update()
+        if not lines:
+            return
+
+        self.journal += len(lines)
+        if self.journal > 2 * len(self.records) + 64:
+            self.compact()
+            return
+        with open(self.path, "a") as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def compact(self):
+        data = self.wayctl.session_header() + "".join(r + "\n" for r in self.records.values())
+        self.wayctl.write_session_file(self.path, data)
+        self.journal = len(self.records)
+
+    def run(self):
+        # subscribe first, anything that changes while taking the snapshot is replayed after it
+        with EventWatcher(self.EVENTS) as watcher:
+            self.full = True
+            self.update()
+            self.compact()
+            print(f"Autosaving {len(self.records)} views to '{self.path}'.")
+            try:
+                while True:
+                    timeout = None
+                    if self.flush_at is not None:
+                        timeout = self.flush_at - time.monotonic()
+                    # blocks without a timeout while the desktop is idle
+                    event = watcher.next_event(timeout)
+                    if event is not None:
+                        self.mark(event)
+                    if self.flush_at is not None and time.monotonic() >= self.flush_at:
+                        self.flush()
+            except KeyboardInterrupt:
+                # changes still waiting for their delay are written before leaving
+                if self.flush_at is not None:
+                    self.flush()
+
+
+class ScreenCapture:
+    """Grab screen regions into memory with grim and hand the encoded bytes to stdout, a file or the clipboard."""
+
+    # formats grim encodes itself, "raw" is an alias of the uncompressed ppm
+    GRIM_FORMATS = {"png": "png", "jpeg": "jpeg", "jpg": "jpeg", "ppm": "ppm", "raw": "ppm"}
+    MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "ppm": "image/x-portable-pixmap", "qoi": "image/qoi"}
+
+    def __init__(self, fmt="png", level=None):
+        fmt = fmt.lower()
+        if fmt != "qoi" and fmt not in self.GRIM_FORMATS:
+            raise ValueError("unknown capture format '{0}', use png, jpeg, ppm/raw or qoi".format(fmt))
+        self.FORMAT = self.GRIM_FORMATS.get(fmt, fmt)
+        self.LEVEL = level # png compression 0-9 or jpeg quality 0-100, None for grim's default
+
+    @property
+    def extension(self):
+        return self.FORMAT
+
+    def grab(self, geometry=None, output=None):
+        """Capture the geometry ("x,y wxh") or the named output, the whole layout if neither is given."""
+        # qoi is encoded from the raw pixels, grim does not write it
+        fmt = "ppm" if self.FORMAT == "qoi" else self.FORMAT
+        cmd = ["grim", "-t", fmt]
+        if self.LEVEL is not None and fmt == "png":
+            cmd += ["-l", str(self.LEVEL)]
+        if self.LEVEL is not None and fmt == "jpeg":
+            cmd += ["-q", str(self.LEVEL)]
+        if output is not None:
+            cmd += ["-o", output]
+        if geometry is not None:
+            cmd += ["-g", geometry]
+        data = check_output(cmd + ["-"])
+        if self.FORMAT == "qoi":
+            data = self.encode_qoi(data)
+        return data
+
+    def grab_outputs(self, outputs):
+        """Capture every output with its own grim, all at once, and composite them by layout geometry."""
+        import asyncio
+
+        async def grab_all():
+            # ppm so the frames can be pasted without decoding
+            procs = [
+                await asyncio.create_subprocess_exec(
+                    "grim", "-t", "ppm", "-o", output["name"], "-", stdout=asyncio.subprocess.PIPE
+                )
+                for output in outputs
+            ]
+            frames = await asyncio.gather(*(proc.communicate() for proc in procs))
+            for proc, output in zip(procs, outputs):
+                if proc.returncode != 0:
+                    raise Exception("grim failed on output {0}".format(output["name"]))
+            return [stdout for stdout, _ in frames]
+
+        return self.encode_ppm(self.composite(outputs, asyncio.run(grab_all())))
+
+    def composite(self, outputs, frames):
+        """Paste the ppm frame of every output at its layout position into one ppm."""
+        frames = [read_ppm(frame) for frame in frames]
+        # hidpi outputs capture more pixels than their logical size, the canvas takes the largest scale
+        scale = max(frame[0] / output["geometry"]["width"] for output, frame in zip(outputs, frames))
+        left = min(output["geometry"]["x"] for output in outputs)
+        top = min(output["geometry"]["y"] for output in outputs)
+        width = int(round((max(o["geometry"]["x"] + o["geometry"]["width"] for o in outputs) - left) * scale))
+        height = int(round((max(o["geometry"]["y"] + o["geometry"]["height"] for o in outputs) - top) * scale))
+        header = b"P6\n%d %d\n255\n" % (width, height)
+        canvas = bytearray(len(header) + width * height * 3)
+        canvas[:len(header)] = header
+        pixels_at = len(header)
+        for output, (frame_width, frame_height, _, pixels) in zip(outputs, frames):
+            geom = output["geometry"]
+            target_width = int(round(geom["width"] * scale))
+            target_height = int(round(geom["height"] * scale))
+            if (frame_width, frame_height) != (target_width, target_height):
+                from PIL import Image
+
+                img = Image.frombytes("RGB", (frame_width, frame_height), pixels)
+                pixels = img.resize((target_width, target_height)).tobytes()
+                frame_width, frame_height = target_width, target_height
+            x = int(round((geom["x"] - left) * scale))
+            y = int(round((geom["y"] - top) * scale))
+            stride = frame_width * 3
+            # clipped to the canvas, the rounding of fractional scales can overhang by a pixel
+            row = min(stride, (width - x) * 3)
+            pixels = memoryview(pixels)
+            for line in range(min(frame_height, height - y)):
+                start = pixels_at + ((y + line) * width + x) * 3
+                canvas[start:start + row] = pixels[line * stride:line * stride + row]
+        return canvas
+
+    def encode_ppm(self, ppm):
+        """Encode a ppm this capture made itself into the capture's format."""
+        if self.FORMAT == "ppm":
+            return ppm
+        if self.FORMAT == "qoi":
+            return self.encode_qoi(ppm)
+        from PIL import Image
+
+        options = {}
+        if self.LEVEL is not None:
+            options = {"compress_level": self.LEVEL} if self.FORMAT == "png" else {"quality": self.LEVEL}
+        out = io.BytesIO()
+        with Image.open(io.BytesIO(ppm)) as img:
+            img.save(out, self.FORMAT.upper(), **options)
+        return out.getvalue()
+
+    def encode_qoi(self, ppm):
+        from PIL import Image
+
+        if "QOI" not in Image.SAVE:
+            raise Exception("this Pillow cannot write qoi, it needs Pillow 11.3 or later")
+        out = io.BytesIO()
+        with Image.open(io.BytesIO(ppm)) as img:
+            img.save(out, "QOI")
+        return out.getvalue()
+
+    def deliver(self, data, target):
+        """Write data to stdout ("stdout" or "-"), the clipboard ("clipboard") or a file path."""
+        if target in ("stdout", "-"):
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+        elif target == "clipboard":
+            proc = Popen(["wl-copy", "--type", self.MIME_TYPES[self.FORMAT]], stdin=s.PIPE)
+            proc.communicate(data)
+        else:
+            with open(target, "wb") as f:
+                f.write(data)
+
+
+def read_ppm(data):
+    """Split a binary ppm into (width, height, maxval, pixel bytes) without decoding it."""
+    fields = []
+    pos = 0
+    while len(fields) < 4:
+        while data[pos:pos + 1].isspace():
+            pos += 1
+        if data[pos:pos + 1] == b"#":
+            pos = data.index(b"\n", pos) + 1
+            continue
+        end = pos
+        while not data[end:end + 1].isspace():
+            end += 1
+        fields.append(data[pos:end])
+        pos = end
+    if fields[0] != b"P6":
+        raise ValueError("not a binary ppm: {0!r}".format(fields[0]))
+    # exactly one whitespace byte separates the header from the pixels
+    return int(fields[1]), int(fields[2]), int(fields[3]), data[pos + 1:]
+
+
+def color_hex(rgb):
+    return "#{0:02X}{1:02X}{2:02X}".format(*(int(round(c)) for c in rgb))
+
+
+class ColorPicker:
+    """Read colours from a screen region, grabbing only the pixels the answer needs."""
+
+    def __init__(self, palette=5):
+        self.PALETTE = palette # colours in the region palette
+
+    def grab(self, geometry):
+        return read_ppm(check_output(["grim", "-t", "ppm", "-g", geometry, "-"]))
+
+    def center(self, geometry):
+        position, size = geometry.split()
+        x, y = (int(n) for n in position.split(","))
+        width, height = (int(n) for n in size.split("x"))
+        return "{0},{1} 1x1".format(x + width // 2, y + height // 2)
+
+    def pick(self, geometry):
+        # a 1x1 logical box is a few physical pixels on scaled outputs, the first one is the centre
+        _, _, _, pixels = self.grab(self.center(geometry))
+        return color_hex(pixels[:3])
+
+    def pixels(self, geometry):
+        import numpy as np
+
+        width, height, maxval, data = self.grab(geometry)
+        pixels = np.frombuffer(data, dtype=np.uint8, count=width * height * 3).reshape(-1, 3)
+        if maxval != 255:
+            pixels = pixels * (255.0 / maxval)
+        return pixels
+
+    def dominant(self, pixels):
+        import numpy as np
+
+        # 5 bits per channel buckets, the busiest bucket's mean is the dominant colour
+        q = pixels.astype(np.uint32) >> 3
+        buckets = (q[:, 0] << 10) | (q[:, 1] << 5) | q[:, 2]
+        busiest = np.bincount(buckets, minlength=1 << 15).argmax()
+        return pixels[buckets == busiest].mean(axis=0)
+
+    def palette(self, pixels, iterations=10):
+        import numpy as np
+
+        # k-means over a strided sample, seeded along the brightness range so it is deterministic
+        sample = pixels[:: max(1, len(pixels) // 65536)].astype(np.float32)
+        k = min(self.PALETTE, len(np.unique(sample, axis=0)))
+        order = np.argsort(sample.sum(axis=1))
+        centers = sample[order[np.linspace(0, len(order) - 1, k).astype(int)]]
+        for _ in range(iterations):
+            distances = ((sample[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+            labels = distances.argmin(axis=1)
+            for i in range(k):
+                members = sample[labels == i]
+                if len(members):
+                    centers[i] = members.mean(axis=0)
+        counts = np.bincount(labels, minlength=k)
+        return [(centers[i], counts[i] / len(sample)) for i in np.argsort(-counts)]
+
+    def region(self, geometry):
+        import numpy as np
+
+        pixels = self.pixels(geometry)
+        return {
+            "geometry": geometry,
+            "pixels": len(pixels),
+            "mean": color_hex(pixels.mean(axis=0)),
+            "median": color_hex(np.median(pixels, axis=0)),
+            "dominant": color_hex(self.dominant(pixels)),
+            "palette": [
+                {"color": color_hex(color), "share": round(float(share), 4)}
+                for color, share in self.palette(pixels)
+            ],
+        }
+
+    def watch(self, geometry, rate=10):
+        """Resample the region rate times a second and print its colour whenever it changes."""
+        # a 1x1 region is a pixel read, anything larger is averaged
+        if geometry.endswith(" 1x1"):
+            sample = self.pick
+        else:
+            sample = lambda g: color_hex(self.pixels(g).mean(axis=0))
+        last = None
+        next_sample = time.monotonic()
+        try:
+            while True:
+                color = sample(geometry)
+                if color != last:
+                    print(color, flush=True)
+                    last = color
+                next_sample += 1.0 / rate
+                delay = next_sample - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # fell behind, do not burst to catch up
+                    next_sample = time.monotonic()
+        except KeyboardInterrupt:
+            pass
+
+
+class ViewCapture:
+    """Capture many views over one pipelined request stream and convert the files in a worker pool."""
+
+    # the last chunk of every png, the file is complete once it ends with it
+    PNG_END = b"IEND\xaeB`\x82"
+
+    def __init__(self, wayctl, directory, fmt=None, workers=4, timeout=5):
+        self.wayctl = wayctl
+        self.directory = directory
+        self.FORMAT = fmt # convert the captures to jpeg/webp/..., None keeps the png
+        self.WORKERS = workers # conversions running at once
+        self.TIMEOUT = timeout # seconds a capture gets to land on disk
+
+    def select(self, views, app_id=None, workspace=None):
+        if app_id is not None:
+            views = [view for view in views if view["app-id"].lower() == app_id.lower()]
+        if workspace is not None:
+            x, y = (int(n) for n in workspace.split(","))
+            workspaces = self.wayctl.view_workspaces(views, self.wayctl.sock.get_focused_output())
+            views = [view for view in views if workspaces.get(view["id"]) == {"x": x, "y": y}]
+        return views
+
+    def written(self, filename):
+        # wait for the compositor to finish the file, not for a fixed delay
+        deadline = time.monotonic() + self.TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                with open(filename, "rb") as f:
+                    f.seek(-len(self.PNG_END), os.SEEK_END)
+                    if f.read() == self.PNG_END:
+                        return True
+            except OSError:
+                # not created yet or still shorter than the trailer
+                pass
+            time.sleep(0.005)
+        return False
+
+    def convert(self, filename):
+        from PIL import Image
+
+        target = "{0}.{1}".format(os.path.splitext(filename)[0], self.FORMAT)
+        with Image.open(filename) as img:
+            if self.FORMAT.lower() in ("jpg", "jpeg"):
+                img = img.convert("RGB")
+            img.save(target, optimize=True)
+        os.remove(filename)
+        return target
+
+    def finish(self, view, filename, started):
+        if not self.written(filename):
+            return view, None, "not written", time.monotonic() - started
+        if self.FORMAT:
+            filename = self.convert(filename)
+        return view, filename, "ok", time.monotonic() - started
+
+    def run(self, views):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.wayctl.create_directory(self.directory)
+        start = time.monotonic()
+        requests = []
+        files = []
+        for view in views:
+            capture = get_msg_template("view-shot/capture")
+            capture["data"]["view-id"] = view["id"]
+            capture["data"]["file"] = os.path.join(self.directory, "{0}.png".format(view["id"]))
+            requests.append(capture)
+            files.append(capture["data"]["file"])
+
+        # every capture request is written before the first reply is read, one pass over the socket
+        replies = send_pipelined(self.wayctl.sock, requests)
+
+        captured = []
+        with ThreadPoolExecutor(self.WORKERS) as pool:
+            jobs = []
+            for view, filename, reply in zip(views, files, replies):
+                if isinstance(reply, Exception):
+                    print("[{0}: {1}] failed: {2}".format(view["id"], view["app-id"], reply))
+                    continue
+                jobs.append(pool.submit(self.finish, view, filename, start))
+            for job in jobs:
+                view, filename, status, elapsed = job.result()
+                print("[{0}: {1}] {2} ({3:.0f} ms)".format(view["id"], view["app-id"], filename or status, elapsed * 1000))
+                if filename:
+                    captured.append((view, filename))
+        print(
+            "captured {0} of {1} views in {2:.0f} ms".format(
+                len(captured), len(views), (time.monotonic() - start) * 1000
+            )
+        )
+        return captured
+
+
+class Timelapse:
+    """Append-only archive of tile-deduplicated frames, with a fixed-size index for any frame.
+
+    Frames are cut into TILE x TILE tiles. A tile that differs from the previous
+    frame is hashed, and only a hash never seen before stores its zlib-compressed
+    pixels, so a static screen writes a tile table entry per changed tile and
+    nothing at all otherwise. Every KEYFRAME frames the record lists every tile,
+    which bounds how far back an extraction has to walk.
+
+    The archive holds the header, then blobs and frame records in the order they
+    were written. The <archive>.idx file has one INDEX entry per frame, pointing
+    at its record, and is only appended once the frame is on disk, so both files
+    can be mapped and read while a capture is still writing them.
+    """
+
+    MAGIC = b"wayctlTL"
+    VERSION = 1
+    # magic, version, tile size, width, height
+    HEADER = struct.Struct("<8sHHII")
+    # timestamp, tile entries, keyframe
+    FRAME = struct.Struct("<dIB")
+    # tile number, blob offset, blob length
+    TILE = struct.Struct("<IQI")
+    # frame record offset, timestamp, keyframe
+    INDEX = struct.Struct("<QdB")
+
+    def __init__(self, path, tile=64, keyframe=300, level=1):
+        self.path = os.path.abspath(path)
+        self.index_path = self.path + ".idx"
+        self.TILE_SIZE = tile
+        self.KEYFRAME = keyframe # frames between full tile tables
+        self.LEVEL = level # zlib level of the stored tiles
+        self.archive = None
+        self.previous = None
+        self.refs = None
+        self.blobs = {}
+        self.since_keyframe = 0
+        self.shape = None # of the last frame, to report a resize once
+
+    def read_header(self, data):
+        magic, version, tile, width, height = self.HEADER.unpack_from(data)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError("{0} is not a wayctl timelapse archive".format(self.path))
+        self.TILE_SIZE, self.width, self.height = tile, width, height
+
+    def open(self, width, height):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.HEADER.size:
+            # appending to an earlier capture, which must be of the same size
+            with open(self.path, "rb") as f:
+                self.read_header(f.read(self.HEADER.size))
+            if (self.width, self.height) != (width, height):
+                raise ValueError(
+                    "{0} holds {1}x{2} frames, not {3}x{4}".format(self.path, self.width, self.height, width, height)
+                )
+        else:
+            self.width, self.height = width, height
+            with open(self.path, "wb") as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.TILE_SIZE, width, height))
+            open(self.index_path, "wb").close()
+        self.archive = open(self.path, "ab")
+        self.index = open(self.index_path, "ab")
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+            self.index.close()
+            self.archive = None
+
+    def tiles(self, frame):
+        import numpy as np
+
+        # (rows of tiles, columns of tiles, TILE, TILE, 3), padded to whole tiles
+        tile = self.TILE_SIZE
+        rows, columns = -(-self.height // tile), -(-self.width // tile)
+        padded = np.zeros((rows * tile, columns * tile, 3), dtype=np.uint8)
+        # the archive keeps the size of its first frame, a resized view is cropped or padded to it
+        height, width = min(self.height, frame.shape[0]), min(self.width, frame.shape[1])
+        if frame.shape[:2] != self.shape and frame.shape[:2] != (self.height, self.width):
+            print(
+                "wayctl: frames are now {0}x{1}, stored cropped or padded to {2}x{3}".format(
+                    frame.shape[1], frame.shape[0], self.width, self.height
+                ),
+                file=sys.stderr,
+            )
+        self.shape = frame.shape[:2]
+        padded[:height, :width] = frame[:height, :width]
+        return padded.reshape(rows, tile, columns, tile, 3).swapaxes(1, 2)
+
+    def add(self, frame, timestamp):
+        """Append a (height, width, 3) uint8 frame, returns how many tiles changed and the bytes written."""
+        import hashlib
+        import zlib
+
+        if self.archive is None:
+            self.open(frame.shape[1], frame.shape[0])
+        tiles = self.tiles(frame)
+        rows, columns = tiles.shape[:2]
+        if self.previous is None:
+            changed = [(row, column) for row in range(rows) for column in range(columns)]
+            self.refs = [None] * (rows * columns)
+        else:
+            # one vectorised comparison, only the tiles that differ are hashed
+            changed = list(zip(*(tiles != self.previous).any(axis=(2, 3, 4)).nonzero()))
+        self.previous = tiles
+
+        start = self.archive.tell()
+        for row, column in changed:
+            data = tiles[row, column].tobytes()
+            digest = hashlib.blake2b(data, digest_size=16).digest()
+            if digest not in self.blobs:
+                blob = zlib.compress(data, self.LEVEL)
+                self.blobs[digest] = (self.archive.tell(), len(blob))
+                self.archive.write(blob)
+            self.refs[int(row) * columns + int(column)] = self.blobs[digest]
+
+        keyframe = self.since_keyframe == 0
+        self.since_keyframe = (self.since_keyframe + 1) % self.KEYFRAME
+        if keyframe:
+            entries = list(enumerate(self.refs))
+        else:
+            entries = [(int(row) * columns + int(column), self.refs[int(row) * columns + int(column)]) for row, column in changed]
+        record = self.archive.tell()
+        self.archive.write(self.FRAME.pack(timestamp, len(entries), keyframe))
+        self.archive.write(b"".join(self.TILE.pack(number, offset, length) for number, (offset, length) in entries))
+        self.archive.flush()
+        # the frame exists for readers once its index entry does
+        self.index.write(self.INDEX.pack(record, timestamp, keyframe))
+        self.index.flush()
+        return len(changed), self.archive.tell() - start
+
+    def frames(self):
+        return os.path.getsize(self.index_path) // self.INDEX.size
+
+    def frame(self, number):
+        """The frame as a ppm, negative numbers count from the last one."""
+        import numpy as np
+        import zlib
+
+        with open(self.path, "rb") as f, open(self.index_path, "rb") as i:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            index = mmap.mmap(i.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.read_header(data)
+                count = len(index) // self.INDEX.size
+                if number < 0:
+                    number += count
+                if not 0 <= number < count:
+                    raise IndexError("{0} has {1} frames, no frame {2}".format(self.path, count, number))
+                # newest first back to the keyframe, the first ref seen for a tile is its current one
+                refs = {}
+                for n in range(number, -1, -1):
+                    record, _, keyframe = self.INDEX.unpack_from(index, n * self.INDEX.size)
+                    _, entries, _ = self.FRAME.unpack_from(data, record)
+                    at = record + self.FRAME.size
+                    for _ in range(entries):
+                        tile, offset, length = self.TILE.unpack_from(data, at)
+                        refs.setdefault(tile, (offset, length))
+                        at += self.TILE.size
+                    if keyframe:
+                        break
+                tile = self.TILE_SIZE
+                rows, columns = -(-self.height // tile), -(-self.width // tile)
+                canvas = np.zeros((rows, columns, tile, tile, 3), dtype=np.uint8)
+                for tile_number, (offset, length) in refs.items():
+                    pixels = zlib.decompress(data[offset:offset + length])
+                    canvas[divmod(tile_number, columns)] = np.frombuffer(pixels, dtype=np.uint8).reshape(tile, tile, 3)
+            finally:
+                data.close()
+                index.close()
+        pixels = canvas.swapaxes(1, 2).reshape(rows * tile, columns * tile, 3)[:self.height, :self.width]
+        return b"P6\n%d %d\n255\n" % (self.width, self.height) + np.ascontiguousarray(pixels).tobytes()
+
+    def info(self):
+        with open(self.path, "rb") as f:
+            self.read_header(f.read(self.HEADER.size))
+        frames = self.frames()
+        return {
+            "frames": frames,
+            "size": "{0}x{1}".format(self.width, self.height),
+            "tile": self.TILE_SIZE,
+            "archive_bytes": os.path.getsize(self.path) + os.path.getsize(self.index_path),
+            # what the same frames would take uncompressed
+            "raw_bytes": frames * self.width * self.height * 3,
+        }
+
+
+class ViewAnnotator:
+    """Label view screenshots with their id, pid and title, alone or as one contact sheet.
+
+    Fonts and rendered label masks are kept at class level, so a daemon
+    rendering report after report loads the font once and reuses the labels of
+    views it has already seen.
+    """
+
+    FONT_PATH = "SourceCodePro-ExtraLight.otf"
+    COLOR = (80, 80, 80)
+    fonts = {}
+    masks = {}
+    advances = {}
+    MAX_MASKS = 4096 # labels kept, the oldest go first
+
+    def __init__(self, font_size=22, workers=4):
+        self.FONT_SIZE = font_size
+        self.WORKERS = workers # screenshots decoded and scaled at once
+
+    def font(self):
+        from PIL import ImageFont
+
+        key = (self.FONT_PATH, self.FONT_SIZE)
+        if key not in self.fonts:
+            try:
+                self.fonts[key] = ImageFont.truetype(self.FONT_PATH, size=self.FONT_SIZE)
+            except OSError:
+                # the font is looked up in the working directory, without it the labels still render
+                self.fonts[key] = ImageFont.load_default(self.FONT_SIZE)
+        return self.fonts[key]
+
+    def label(self, view):
+        return f"ID: {view['id']}, PID: {view['pid']}, Title: {view['title']}"
+
+    def mask(self, text):
+        key = (self.FONT_PATH, self.FONT_SIZE, text)
+        mask = self.masks.pop(key, None)
+        if mask is None:
+            mask = self.font().getmask(text, "L")
+            if len(self.masks) >= self.MAX_MASKS:
+                self.masks.pop(next(iter(self.masks)))
+        # reinserted so the dict keeps the most recently used last
+        self.masks[key] = mask
+        return mask
+
+    def advance(self, char):
+        # glyph widths summed without kerning, close enough to decide where a label is cut
+        key = (self.FONT_PATH, self.FONT_SIZE, char)
+        if key not in self.advances:
+            self.advances[key] = self.font().getlength(char)
+        return self.advances[key]
+
+    def fit(self, text, width):
+        # the longest prefix that fits the cell with the ellipsis, measured without rendering
+        if sum(self.advance(char) for char in text) <= width:
+            return text
+        used = self.advance(".") * 3
+        for end, char in enumerate(text):
+            used += self.advance(char)
+            if used > width:
+                return text[:end] + "..."
+        return text
+
+    def render_label(self, view, filename):
+        from PIL import Image
+
+        mask = self.mask(self.label(view))
+        size = mask.size[0] + 20, mask.size[1] + 20
+        img = Image.new("RGBA", size)
+        img.im.paste(self.COLOR, (20, 20) + size, mask)
+        img.save(filename)
+
+    def thumbnail(self, filename, size):
+        from PIL import Image
+
+        with Image.open(filename) as img:
+            # reducing_gap shrinks by whole factors first, far cheaper than resampling the full capture
+            img.thumbnail(size, Image.BILINEAR, reducing_gap=2.0)
+            return img.convert("RGB")
+
+    def contact_sheet(self, captured, filename, columns=5, cell_width=320):
+        """Tile every (view, screenshot file) in a grid with its label below it, and save it to filename."""
+        from PIL import Image
+        from concurrent.futures import ThreadPoolExecutor
+
+        if not captured:
+            return None
+        cell_height = cell_width * 9 // 16
+        label_height = self.FONT_SIZE + 8
+        padding = 10
+        rows = (len(captured) + columns - 1) // columns
+        sheet = Image.new(
+            "RGB",
+            (columns * (cell_width + padding) + padding, rows * (cell_height + label_height + padding) + padding),
+            (255, 255, 255),
+        )
+        # decoding and scaling release the GIL, they run side by side
+        with ThreadPoolExecutor(self.WORKERS) as pool:
+            thumbnails = pool.map(lambda item: self.thumbnail(item[1], (cell_width, cell_height)), captured)
+            for i, ((view, _), thumbnail) in enumerate(zip(captured, thumbnails)):
+                left = padding + (i % columns) * (cell_width + padding)
+                top = padding + (i // columns) * (cell_height + label_height + padding)
+                # centred in its cell
+                sheet.paste(
+                    thumbnail,
+                    (left + (cell_width - thumbnail.width) // 2, top + (cell_height - thumbnail.height) // 2),
+                )
+                mask = self.mask(self.fit(self.label(view), cell_width))
+                box = (left, top + cell_height + 4, left + mask.size[0], top + cell_height + 4 + mask.size[1])
+                sheet.im.paste(self.COLOR, box, mask)
+        sheet.save(filename)
+        return filename
+
+
+class ViewQuery:
+    """Filter and project one list-views snapshot, streaming the matches as they are found."""
+
+    # geometry predicates like width>=800, x<0 or height=600
+    GEOMETRY_PREDICATE = re.compile(r"^(x|y|width|height)(<=|>=|!=|<|>|=)(-?\d+)$")
+    COMPARE = {
+        "<": lambda a, b: a < b,
+        "<=": lambda a, b: a <= b,
+        ">": lambda a, b: a > b,
+        ">=": lambda a, b: a >= b,
+        "=": lambda a, b: a == b,
+        "!=": lambda a, b: a != b,
+    }
+    STATES = {"minimized": "minimized", "sticky": "sticky", "on-top": "always-on-top", "fullscreen": "fullscreen"}
+    TABLE_FIELDS = ["id", "pid", "app-id", "output-name", "title"]
+
+    def __init__(self, words):
+        self.predicates = []
+        self.fields = None
+        self.format = "pretty"
+        self.include_focused = False
+        self.workspace = None
+        for key, value in zip(words[::2], words[1::2]):
+            if key == "app-id":
+                self.predicates.append(lambda v, value=value.lower(): v["app-id"].lower() == value)
+            elif key == "title":
+                pattern = re.compile(value, re.IGNORECASE)
+                self.predicates.append(lambda v, pattern=pattern: pattern.search(v["title"]) is not None)
+            elif key == "has_title":
+                self.predicates.append(lambda v, value=value.lower(): value in v["title"].lower())
+            elif key == "pid":
+                self.predicates.append(lambda v, pid=int(value): v["pid"] == pid)
+            elif key == "output":
+                self.predicates.append(
+                    lambda v, value=value: v.get("output-name") == value or str(v["output-id"]) == value
+                )
+            elif key in self.STATES:
+                self.predicates.append(
+                    lambda v, name=self.STATES[key], state=value in ("yes", "true", "1"): bool(v.get(name)) == state
+                )
+            elif key == "geometry":
+                for predicate in value.split(","):
+                    self.predicates.append(self.geometry_predicate(predicate))
+            elif key == "workspace":
+                self.workspace = {k: int(n) for k, n in zip("xy", value.split(","))}
+            elif key == "fields":
+                self.fields = [field.split(".") for field in value.split(",")]
+            elif key == "format":
+                if value not in ("pretty", "ndjson", "table"):
+                    raise ValueError("unknown view list format '{0}', use pretty, ndjson or table".format(value))
+                self.format = value
+            elif key == "focused":
+                self.include_focused = value in ("yes", "true", "1")
+            else:
+                raise ValueError("unknown view list filter '{0}'".format(key))
+
+    def geometry_predicate(self, predicate):
+        match = self.GEOMETRY_PREDICATE.match(predicate.strip())
+        if match is None:
+            raise ValueError("bad geometry predicate '{0}', expected like width>=800".format(predicate))
+        key, op, number = match.groups()
+        compare, number = self.COMPARE[op], int(number)
+        return lambda v: compare(v["geometry"][key], number)
+
+    def project(self, view):
+        if self.fields is None:
+            return view
+        projected = {}
+        for path in self.fields:
+            value = view
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            projected[".".join(path)] = value
+        return projected
+
+    def select(self, views, workspaces=None):
+        # without a focus query the most recently focused view is the focused one
+        focused_id = None
+        if not self.include_focused and views:
+            focused_id = max(views, key=lambda v: v.get("last-focus-timestamp", 0))["id"]
+        for view in views:
+            if view["id"] == focused_id:
+                continue
+            if workspaces is not None and workspaces.get(view["id"]) != self.workspace:
+                continue
+            if all(predicate(view) for predicate in self.predicates):
+                yield self.project(view)
+
+    def write(self, views, out):
+        if self.format == "ndjson":
+            for view in views:
+                out.write(json.dumps(view, separators=(",", ":")) + "\n")
+        elif self.format == "table":
+            fields = [".".join(path) for path in self.fields] if self.fields else self.TABLE_FIELDS
+            out.write("\t".join(fields) + "\n")
+            for view in views:
+                out.write("\t".join(str(view.get(field, "")) for field in fields) + "\n")
+        else:
+            for view in views:
+                out.write("[{0}: {1}]\n".format(view.get("app-id"), view.get("title")))
+                out.write(json.dumps(view, indent=4) + "\n\n\n\n")
+
+
+class LayoutEngine:
+    """Compute the geometry of every tiled view on the focused output's workarea in one pass.
+
+    Each layout returns {view id: geometry} for the views it places, changes()
+    drops the ones already there so only real moves are configured.
+    """
+
+    # (position key, size key) per axis, and the axis and side each direction moves
+    AXES = {"x": ("x", "width"), "y": ("y", "height")}
+    DIRECTIONS = {"left": ("x", -1), "right": ("x", 1), "up": ("y", -1), "down": ("y", 1)}
+
+    def __init__(self, views, output, gap=0, min_size=100):
+        self.workarea = output["workarea"]
+        self.GAP = gap # pixels between tiled views and around the workarea
+        self.MIN_SIZE = min_size # a resize never makes a view smaller than this
+        self.SNAP = 16 # views whose edges are this close share the edge, whatever gap they were tiled with
+        size = output["geometry"]
+        # geometries are relative to the current workspace of the output
+        self.views = [
+            view
+            for view in views
+            if view["output-id"] == output["id"]
+            and view.get("role", "toplevel") == "toplevel"
+            and view.get("mapped", True)
+            and not view["minimized"]
+            and not view.get("fullscreen")
+            and self.on_workspace(view["geometry"], size)
+        ]
+        self.focused = max(self.views, key=lambda v: v.get("last-focus-timestamp", 0)) if self.views else None
+
+    def on_workspace(self, geom, size):
+        return (
+            geom["x"] < size["width"]
+            and geom["y"] < size["height"]
+            and geom["x"] + geom["width"] > 0
+            and geom["y"] + geom["height"] > 0
+        )
+
+    def cells(self, count, axis, area=None):
+        # split the area into count equal cells along the axis, the last one takes the rounding
+        area = area or self.workarea
+        pos_key, size_key = self.AXES[axis]
+        total = area[size_key] - self.GAP * (count + 1)
+        cells = []
+        for i in range(count):
+            cell = dict(area)
+            start = area[pos_key] + self.GAP + i * (total // count + self.GAP)
+            cell[pos_key] = start
+            cell[size_key] = total // count if i < count - 1 else total - (count - 1) * (total // count)
+            other_pos, other_size = self.AXES["y" if axis == "x" else "x"]
+            cell[other_pos] = area[other_pos] + self.GAP
+            cell[other_size] = area[other_size] - 2 * self.GAP
+            cells.append({k: cell[k] for k in ("x", "y", "width", "height")})
+        return cells
+
+    def ordered(self, axis):
+        # keep the current arrangement, views are placed in the order they already are
+        pos_key, _ = self.AXES[axis]
+        other_key = "y" if pos_key == "x" else "x"
+        return sorted(self.views, key=lambda v: (v["geometry"][pos_key], v["geometry"][other_key], v["id"]))
+
+    def split(self):
+        views = self.ordered("x")
+        return {view["id"]: cell for view, cell in zip(views, self.cells(len(views), "x"))}
+
+    def stack(self):
+        views = self.ordered("y")
+        return {view["id"]: cell for view, cell in zip(views, self.cells(len(views), "y"))}
+
+    def master(self, ratio=0.55):
+        if not self.views:
+            return {}
+        others = [view for view in self.ordered("y") if view is not self.focused]
+        if not others:
+            return {self.focused["id"]: self.cells(1, "x")[0]}
+        master_area = dict(self.workarea, width=int(self.workarea["width"] * ratio))
+        stack_area = dict(
+            self.workarea,
+            x=self.workarea["x"] + master_area["width"] - self.GAP,
+            width=self.workarea["width"] - master_area["width"] + self.GAP,
+        )
+        targets = {self.focused["id"]: self.cells(1, "x", master_area)[0]}
+        for view, cell in zip(others, self.cells(len(others), "y", stack_area)):
+            targets[view["id"]] = cell
+        return targets
+
+    def swap(self):
+        # mirror every view around the middle of the workarea, the left side becomes the right one
+        left, width = self.workarea["x"], self.workarea["width"]
+        targets = {}
+        for view in self.views:
+            geom = dict(view["geometry"])
+            geom["x"] = left + width - (geom["x"] - left) - geom["width"]
+            targets[view["id"]] = geom
+        return targets
+
+    def resize(self, direction, step=50, grow=True):
+        """Move the focused view's edge in direction, the views sharing that edge give or take the space."""
+        if self.focused is None:
+            return {}
+        axis, side = self.DIRECTIONS[direction]
+        pos_key, size_key = self.AXES[axis]
+        other_pos, other_size = self.AXES["y" if axis == "x" else "x"]
+        focused = dict(self.focused["geometry"])
+        edge = focused[pos_key] + (focused[size_key] if side > 0 else 0)
+        delta = side * step if grow else -side * step
+
+        # neighbours touch the moving edge and overlap the focused view across it
+        neighbours = []
+        for view in self.views:
+            if view is self.focused:
+                continue
+            geom = view["geometry"]
+            near_edge = geom[pos_key] if side > 0 else geom[pos_key] + geom[size_key]
+            overlaps = (
+                geom[other_pos] < focused[other_pos] + focused[other_size]
+                and geom[other_pos] + geom[other_size] > focused[other_pos]
+            )
+            if abs(near_edge - edge) <= self.SNAP and overlaps:
+                neighbours.append(view)
+
+        low = self.workarea[pos_key] + self.GAP
+        high = self.workarea[pos_key] + self.workarea[size_key] - self.GAP
+        # the edge stays inside the workarea and leaves every view at least MIN_SIZE
+        if side > 0:
+            limit_low = focused[pos_key] + self.MIN_SIZE
+            limit_high = min(
+                [high] + [v["geometry"][pos_key] + v["geometry"][size_key] - self.MIN_SIZE for v in neighbours]
+            )
+        else:
+            limit_low = max(
+                [low] + [v["geometry"][pos_key] + self.MIN_SIZE for v in neighbours]
+            )
+            limit_high = focused[pos_key] + focused[size_key] - self.MIN_SIZE
+        new_edge = max(limit_low, min(limit_high, edge + delta))
+        moved = new_edge - edge
+        if moved == 0:
+            return {}
+
+        if side > 0:
+            focused[size_key] += moved
+        else:
+            focused[pos_key] += moved
+            focused[size_key] -= moved
+        targets = {self.focused["id"]: focused}
+        for view in neighbours:
+            geom = dict(view["geometry"])
+            if side > 0:
+                geom[pos_key] += moved
+                geom[size_key] -= moved
+            else:
+                geom[size_key] += moved
+            targets[view["id"]] = geom
+        return targets
+
+    def changes(self, targets):
+        current = {view["id"]: view["geometry"] for view in self.views}
+        keys = ("x", "y", "width", "height")
+        return {
+            view_id: geom
+            for view_id, geom in targets.items()
+            if any(current[view_id][k] != geom[k] for k in keys)
+        }
+
+
+class ViewIndex:
+    """Uniform grid over the view geometries of one list_views() snapshot.
+
+    Views are bucketed per (output id, workspace x, workspace y) in cells of
+    CELL pixels of that workspace's own coordinates, so a query only looks at the
+    cells it covers instead of every view. Points and rectangles given to the
+    queries are in layout coordinates and land on the current workspace of
+    whichever outputs they cover.
+    """
+
+    CELL = 256
+
+    def __init__(self, views, outputs):
+        self.outputs = {output["id"]: output for output in outputs}
+        self.views = {}
+        self.cells = {}
+        for view in views:
+            output = self.outputs.get(view.get("output-id"))
+            if output is None or view["minimized"] or not view.get("mapped", True):
+                continue
+            if view.get("role", "toplevel") != "toplevel":
+                continue
+            self.insert(view, output)
+
+    def workspace_of(self, geom, output):
+        # view geometry is relative to the output's current workspace
+        size = output["geometry"]
+        ws = output["workspace"]
+        center_x = geom["x"] + geom["width"] // 2
+        center_y = geom["y"] + geom["height"] // 2
+        return ws["x"] + center_x // size["width"], ws["y"] + center_y // size["height"]
+
+    def insert(self, view, output):
+        ws_x, ws_y = self.workspace_of(view["geometry"], output)
+        size = output["geometry"]
+        ws = output["workspace"]
+        # position inside its own workspace, so every workspace shares the same cell grid
+        geom = dict(view["geometry"])
+        geom["x"] -= (ws_x - ws["x"]) * size["width"]
+        geom["y"] -= (ws_y - ws["y"]) * size["height"]
+        key = (output["id"], ws_x, ws_y)
+        self.views[view["id"]] = (view, key, geom)
+        for cell in self.covered(key, geom):
+            self.cells.setdefault(cell, []).append(view["id"])
+
+    def covered(self, key, rect):
+        first_x, last_x = rect["x"] // self.CELL, (rect["x"] + max(rect["width"], 1) - 1) // self.CELL
+        first_y, last_y = rect["y"] // self.CELL, (rect["y"] + max(rect["height"], 1) - 1) // self.CELL
+        for cx in range(first_x, last_x + 1):
+            for cy in range(first_y, last_y + 1):
+                yield key + (cx, cy)
+
+    def layout_geometry(self, view_id):
+        # where a view on a current workspace is in layout coordinates
+        view, key, geom = self.views[view_id]
+        origin = self.outputs[key[0]]["geometry"]
+        return dict(geom, x=geom["x"] + origin["x"], y=geom["y"] + origin["y"])
+
+    def intersecting(self, rect):
+        """Views on the current workspaces that intersect rect, in layout coordinates."""
+        found = {}
+        for output in self.outputs.values():
+            size = output["geometry"]
+            ws = output["workspace"]
+            # clip to the output, the rest of the rect is somebody else's
+            left = max(rect["x"], size["x"])
+            top = max(rect["y"], size["y"])
+            right = min(rect["x"] + rect["width"], size["x"] + size["width"])
+            bottom = min(rect["y"] + rect["height"], size["y"] + size["height"])
+            if left >= right or top >= bottom:
+                continue
+            local = {"x": left - size["x"], "y": top - size["y"], "width": right - left, "height": bottom - top}
+            for cell in self.covered((output["id"], ws["x"], ws["y"]), local):
+                for view_id in self.cells.get(cell, ()):
+                    if view_id in found:
+                        continue
+                    geom = self.views[view_id][2]
+                    if (
+                        geom["x"] < local["x"] + local["width"]
+                        and geom["x"] + geom["width"] > local["x"]
+                        and geom["y"] < local["y"] + local["height"]
+                        and geom["y"] + geom["height"] > local["y"]
+                    ):
+                        found[view_id] = self.views[view_id][0]
+        return list(found.values())
+
+    def at(self, x, y):
+        """The topmost view under the layout point (x, y), or None."""
+        views = self.intersecting({"x": x, "y": y, "width": 1, "height": 1})
+        if not views:
+            return None
+        # no stacking order over ipc, on-top views first and then the most recently focused
+        return max(views, key=lambda v: (v.get("always-on-top", False), v.get("last-focus-timestamp", 0)))
+
+    def bounds(self):
+        left = min(o["geometry"]["x"] for o in self.outputs.values())
+        top = min(o["geometry"]["y"] for o in self.outputs.values())
+        right = max(o["geometry"]["x"] + o["geometry"]["width"] for o in self.outputs.values())
+        bottom = max(o["geometry"]["y"] + o["geometry"]["height"] for o in self.outputs.values())
+        return left, top, right, bottom
+
+    def nearest(self, view_id, direction):
+        """The closest view in direction from view_id, across outputs, or None.
+
+        A candidate's centre must lie past the view's centre, and it scores
+        how far its near edge is from the view's far edge along the direction,
+        before or past it, plus twice its offset across it. The search
+        window grows until it holds a candidate scoring within the window, so a
+        dense desktop costs the cells around the view, not all of its views.
+        """
+        if view_id not in self.views or self.views[view_id][1][1:] != self.current_workspace(view_id):
+            return None
+        origin = self.layout_geometry(view_id)
+        axis, side = LayoutEngine.DIRECTIONS[direction]
+        pos_key, size_key = LayoutEngine.AXES[axis]
+        other_pos, other_size = LayoutEngine.AXES["y" if axis == "x" else "x"]
+        center = origin[pos_key] + origin[size_key] / 2.0
+        edge = origin[pos_key] + (origin[size_key] if side > 0 else 0)
+        left, top, right, bottom = self.bounds()
+        reach = max(right - left, bottom - top)
+
+        def score(geom):
+            if side * (geom[pos_key] + geom[size_key] / 2.0 - center) <= 0:
+                return None
+            near = geom[pos_key] if side > 0 else geom[pos_key] + geom[size_key]
+            # a view that starts before our edge overlaps us, that is no closer than a gap
+            gap = abs(near - edge)
+            offset = max(
+                0,
+                geom[other_pos] - (origin[other_pos] + origin[other_size]),
+                origin[other_pos] - (geom[other_pos] + geom[other_size]),
+            )
+            return gap + 2 * offset
+
+        distance = self.CELL
+        while True:
+            # the window holds every view scoring up to distance
+            window = {other_pos: origin[other_pos] - distance // 2, other_size: origin[other_size] + distance}
+            if side > 0:
+                window[pos_key], window[size_key] = int(center), int(edge - center) + distance + 1
+            else:
+                window[pos_key], window[size_key] = edge - distance, int(center - edge) + distance + 1
+            best = None
+            for view in self.intersecting(window):
+                if view["id"] == view_id:
+                    continue
+                value = score(self.layout_geometry(view["id"]))
+                if value is not None and (best is None or value < best[0]):
+                    best = (value, view)
+            if best is not None and best[0] <= distance:
+                return best[1]
+            if distance > 2 * reach:
+                # the window now spans the whole layout across the direction too
+                return best[1] if best is not None else None
+            distance *= 2
+
+    def current_workspace(self, view_id):
+        ws = self.outputs[self.views[view_id][1][0]]["workspace"]
+        return ws["x"], ws["y"]
+
+
+def usage_error(message):
+    """Report a bad command line the way argparse does, on stderr with exit status 2."""
+    print("wayctl: error: {0}".format(message), file=sys.stderr)
+    sys.exit(2)
+
+
+def build_parser():
+    # Create an ArgumentParser object to handle command-line arguments
+    parser = argparse.ArgumentParser(
+        description="wayctl script utility for controlling parts of the wayfire compositor through the command line interface or a script."
+    )
+
+    # Add command-line arguments for various actions
+
+    # --view option: Get information about views
+    parser.add_argument(
+        "--view",
+        nargs="*",
+        help="Retrieve information about views. Usage: --view focused (to get information about the focused view), --view at <x> <y> (to get the topmost view under the layout position), --view list [app-id <id>] [title <regex>] [pid <n>] [workspace <x>,<y>] [output <name or id>] [minimized/sticky/on-top/fullscreen yes/no] [geometry <predicates like width>=800,x<0>] [fields <id,title,geometry.width,...>] [format pretty/ndjson/table] [focused yes] (to list the views other than the focused one, or the ones matching every filter).",
+    )
+
+    # --workspace option: Set the focused view to another workspace
+    parser.add_argument(
+        "--workspace",
+        nargs="*",
+        help="Set the focused view to another workspace. Usage: --workspace set view focused <x-coordinate> <y-coordinate> (to set the focused view to the specified workspace coordinates).",
+    )
+
+    parser.add_argument(
+        "--move_cursor",
+        nargs="*",
+        help="move mouse cursor position with <x-coordinate> <y-coordinate>, without coordinates together with --focus the cursor warps to the centre of the newly focused view",
+    )
+
+    parser.add_argument(
+        "--focus",
+        nargs="*",
+        help="Focus the nearest view in a direction from the focused one, across outputs. Usage: --focus left/right/up/down [--move_cursor] (to also warp the cursor to it).",
+    )
+
+    # --dpms option: Set DPMS (Display Power Management Signaling) on/off/toggle
+    parser.add_argument(
+        "--dpms",
+        nargs="*",
+        help="Set DPMS (Display Power Management Signaling) state. Usage: --dpms on/off/toggle <monitor-name> (to turn DPMS on, off, or toggle its state for the specified monitor).",
+    )
+
+    # --output option: Get output (monitor) info
+    parser.add_argument(
+        "--output",
+        nargs="*",
+        help="Retrieve information about outputs (monitors). Usage: --output view list (to view a list of all outputs), --output focused (to get information about the focused output).",
+    )
+
+    # --screenshot option: Capture screenshots with various options
+    parser.add_argument(
+        "--screenshot",
+        nargs="*",
+        help="Capture screenshots with various options. Usage: --screenshot focused view (to capture a screenshot of the focused view), --screenshot slurp (to select a region to screenshot), --screenshot output all [backend portal/grim] [timeout <s>] (to capture the whole desktop through the screenshot portal, or with one grim per output running at once and composited by output geometry), --screenshot view all [app-id <id>] [workspace <x>,<y>] [format <jpg/webp/...>] [workers <n>] [sheet <path> [columns <n>]] (to capture every view, or the ones matching the filters, into /tmp/screenshots, with sheet also tiled into one contact sheet labelled with their id, pid and title), --screenshot timelapse [view <id>/focused] [output <name>/focused] [archive <path>] [interval <s>] [frames <n>] [tile <px>] [keyframe <n>] (to capture the view or output, the focused output by default, every interval seconds into an archive that only stores the tiles that changed, until n frames or ctrl-c), --screenshot timelapse extract <archive> [frame <n>] (to get one frame back, the last by default, negative counts from the end), --screenshot timelapse info <archive>. The focused view, focused output, output all and slurp captures take [to stdout/clipboard/<path>] [format png/jpeg/ppm/raw/qoi] [level <png compression or jpeg quality>], without 'to' they are saved to /tmp and opened.",
+    )
+
+    parser.add_argument(
+        "--colorpicker",
+        nargs="*",
+        help="Color picker using slurp and grim. Usage: --colorpicker (copy the colour at the centre of the selection), --colorpicker region [palette <k>] [geometry '<x>,<y> <w>x<h>'] (mean, median, dominant colour and a k colour palette of the region), --colorpicker watch [rate <hz>] [geometry '<x>,<y> <w>x<h>'] (print the region colour whenever it changes).",
+    )
+
+    # --session option: Print session-related information
+    parser.add_argument(
+        "--session",
+        nargs="*",
+        help="Print session-related information. Usage: --session save (to save views session), --session start [parallel <n>] [timeout <seconds>] (to start a Wayfire session, launching up to n apps at once, 8 by default, each given 30 seconds to map), --session autosave [delay <seconds>] (to keep the session saved as views change), --session migrate (to rewrite an old session file in the current format).",
+    )
+
+    # --resize option: Resize views
+    parser.add_argument(
+        "--resize",
+        nargs="*",
+        help="Resize views. Usage: --resize views [shrink] left/right/up/down [step <px>] (to move the focused view's edge in the specified direction, the views sharing the edge give or take the space, 50 px by default).",
+    )
+
+    # --switch option: Switch views side
+    parser.add_argument(
+        "--switch",
+        nargs="*",
+        help="Switch views side. Usage: --switch views (to switch views side).",
+    )
+
+    parser.add_argument(
+        "--layout",
+        nargs="*",
+        help="Tile the views of the focused output's current workspace. Usage: --layout split/stack/master [ratio <r>] [gap <px>] (side by side, on top of each other, or the focused view on the left with the others stacked on the right, the master taking r of the width, 0.55 by default).",
+    )
+
+    # --plugin option: manager plugins
+    parser.add_argument(
+        "--plugin",
+        nargs="*",
+        help="add, reload and load plugins",
+    )
+
+    parser.add_argument(
+        "--drop",
+        nargs="*",
+        help="start a view in guake mode. Usage: --drop <command> [timeout <seconds>] (seconds to wait for a new view to map, 5 by default).",
+    )
+
+    parser.add_argument(
+        "--watch",
+        nargs="*",
+        help="stream compositor events as JSON lines. Usage: --watch [event <name,name,...>] [app-id <id>] [output <name or id>] [queue <n>] (only the named events are subscribed to, n events are kept for a slow reader, 1024 by default).",
+    )
+
+    parser.add_argument(
+        "--trace",
+        nargs="*",
+        help="record a timeline of IPC calls, subprocesses, sleeps and imports. Usage: --trace (print a summary to stderr), --trace chrome [<file>] (write chrome trace events, wayctl-trace.json by default). Set WAYCTL_TRACE=summary or WAYCTL_TRACE=<file> to trace every command run by the daemon.",
+    )
+
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="run one wayctl command line per line of FILE, or of stdin for -, over a single connection and print one JSON result per command",
+    )
+
+    parser.add_argument(
+        "--schedule",
+        nargs=argparse.REMAINDER,
+        help="run wayctl commands later from the daemon's scheduler, so no process sleeps waiting for them. Usage: --schedule in <s> <wayctl arguments> (once, s seconds from now), --schedule every <s> <wayctl arguments> (every s seconds), --schedule idle <s> <wayctl arguments> (s seconds after the last focus change, again after the next one), --schedule list, --schedule cancel <id>. Needs a running wayctl --daemon.",
+    )
+
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep a wayfire connection and the loaded modules warm, later wayctl calls are forwarded to it",
+    )
+
+    return parser
+
+
+class Wayctl:
+    def __init__(self, args=None):
+        if args is None:
+            args = build_parser().parse_args()
+        self.args = args
+
+    @property
+    def sock(self):
+        return get_sock()
+
+    @property
+    def stipc(self):
+        get_sock()
+        return stipc
+
+    @property
+    def ws_utils(self):
+        get_sock()
+        return ws_utils
+
+
+    def xdg_open(self, path):
+        call("xdg-open {0}".format(path).split())
+    
+    def portal_screenshot(self, timeout=30):
+        """Ask the screenshot portal for the whole desktop and return the path of the file it saved."""
+        import dbus
+        from urllib.parse import unquote, urlparse
+        from dbus.mainloop.glib import DBusGMainLoop
+        from gi.repository import GLib
+
+        DBusGMainLoop(set_as_default=True)
+        bus = dbus.SessionBus()
+        # the request object path is known in advance, subscribe before calling so the
+        # Response can't be missed, and a unique token keeps concurrent calls apart
+        token = "wayctl_{0}_{1}".format(os.getpid(), int(time.monotonic() * 1000))
+        sender = bus.get_unique_name()[1:].replace(".", "_")
+        request_path = "/org/freedesktop/portal/desktop/request/{0}/{1}".format(sender, token)
+        loop = GLib.MainLoop()
+        response = {}
+
+        def on_response(code, results):
+            response["code"] = int(code)
+            response["results"] = results
+            loop.quit()
+
+        def on_timeout():
+            response["timed-out"] = True
+            loop.quit()
+            # removes the source, it must not be removed again
+            return False
+
+        match = bus.add_signal_receiver(
+            on_response,
+            signal_name="Response",
+            dbus_interface="org.freedesktop.portal.Request",
+            path=request_path,
+        )
+        timer = None
+        try:
+            desktop = bus.get_object(
+                "org.freedesktop.portal.Desktop", "/org/freedesktop/portal/desktop"
+            )
+            desktop.Screenshot(
+                "",
+                {"handle_token": token, "interactive": False},
+                dbus_interface="org.freedesktop.portal.Screenshot",
+            )
+            timer = GLib.timeout_add(int(timeout * 1000), on_timeout)
+            loop.run()
+        finally:
+            # the session bus is shared by every command a daemon runs, leave nothing behind on it
+            match.remove()
+            if timer is not None and "timed-out" not in response:
+                GLib.source_remove(timer)
+        if "code" not in response:
+            raise Exception("the screenshot portal did not answer within {0}s".format(timeout))
+        if response["code"] != 0:
+            raise Exception("the screenshot portal request was cancelled or failed ({0})".format(response["code"]))
+        return unquote(urlparse(str(response["results"]["uri"])).path)
+
+    def screenshot_all_outputs(self, words=()):
+        words = list(words)
+        options = dict(zip(words[::2], words[1::2]))
+        capture, target = self.capture_options(words)
+        if options.get("backend", "portal") == "grim":
+            # every output at once, the capture takes as long as the slowest one
+            outputs = self.cached("outputs", self.sock.list_outputs)
+            data = capture.grab_outputs(outputs)
+            self.deliver_capture(capture, data, target, "/tmp/outputs.png")
+            return
+        path = self.portal_screenshot(float(options.get("timeout", 30)))
+        if target is None:
+            self.xdg_open(path)
+        else:
+            # the portal always saves a png
+            with open(path, "rb") as f:
+                ScreenCapture("png").deliver(f.read(), target)
+
+    def capture_options(self, words):
+        # <key> <value> pairs after the screenshot subcommand: to, format, level
+        options = dict(zip(words[::2], words[1::2]))
+        level = options.get("level")
+        capture = ScreenCapture(options.get("format", "png"), None if level is None else int(level))
+        return capture, options.get("to")
+
+    def deliver_capture(self, capture, data, target, default_path):
+        # without a target the capture is saved and opened in the image viewer, as before
+        if target is None:
+            target = "{0}.{1}".format(os.path.splitext(default_path)[0], capture.extension)
+            capture.deliver(data, target)
+            self.xdg_open(target)
+        else:
+            capture.deliver(data, target)
+
+    def view_region(self, view, output=None):
+        # view geometry is relative to its output, grim wants layout coordinates
+        if output is None:
+            output = self.sock.get_output(view["output-id"])
+        geom = view["geometry"]
+        return "{0},{1} {2}x{3}".format(
+            output["geometry"]["x"] + geom["x"],
+            output["geometry"]["y"] + geom["y"],
+            geom["width"],
+            geom["height"],
+        )
+
+    def screenshot_focused_monitor(self, words=()):
+        capture, target = self.capture_options(list(words))
+        name = self.sock.get_focused_output()["name"]
+        data = capture.grab(output=name)
+        self.deliver_capture(capture, data, target, "/tmp/output-{0}.png".format(name))
+
+    def screenshot(self, id, filename):
+        capture = get_msg_template("view-shot/capture")
+        if capture is None:
+            return
+        capture["data"]["view-id"] = id
+        capture["data"]["file"] = filename
+        self.sock.send_json(capture)
+
+    def cached(self, key, live):
+        # read-only commands answer from the daemon's state cache when it is current
+        state = read_state()
+        if state is None:
+            return live()
+        return state[key]
+
+    def view_focused(self):
+        view = self.cached("focused-view", self.sock.get_focused_view)
+        print("[{0}: {1}]".format(view["app-id"], view["title"]))
+        view_str = json.dumps(view, indent=4)
+        print(view_str)
+        print("\n\n")
+
+    def move_cursor(self, x, y):
+        self.stipc.move_cursor(x, y)
+
+    def view_index(self):
+        # one snapshot, from the state cache when the daemon keeps it
+        state = read_state()
+        if state is None:
+            replies = send_pipelined(
+                self.sock,
+                [
+                    get_msg_template("window-rules/list-views"),
+                    get_msg_template("window-rules/list-outputs"),
+                    get_msg_template("window-rules/get-focused-view"),
+                ],
+            )
+            for reply in replies:
+                if isinstance(reply, Exception):
+                    raise reply
+            state = {"views": replies[0], "outputs": replies[1], "focused-view": replies[2].get("info")}
+        return ViewIndex(state["views"], state["outputs"]), state["focused-view"]
+
+    def view_at(self, x, y):
+        index, _ = self.view_index()
+        view = index.at(x, y)
+        if view is None:
+            print("no view at {0},{1}".format(x, y), file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(view, indent=4))
+
+    def focus_direction(self, direction, warp=False):
+        index, focused = self.view_index()
+        if focused is None:
+            return
+        view = index.nearest(focused["id"], direction)
+        if view is None:
+            return
+        msg = get_msg_template("window-rules/focus-view")
+        msg["data"]["id"] = view["id"]
+        requests = [msg]
+        if warp:
+            geom = index.layout_geometry(view["id"])
+            cursor = get_msg_template("stipc/move_cursor")
+            cursor["data"]["x"] = geom["x"] + geom["width"] // 2
+            cursor["data"]["y"] = geom["y"] + geom["height"] // 2
+            requests.append(cursor)
+        for reply in send_pipelined(self.sock, requests):
+            if isinstance(reply, Exception):
+                raise reply
+
+    def session_file(self):
+        home = os.path.expanduser("~")
+        wayfire = ".config/wayfire-session.json"
+        return os.path.join(home, wayfire)
+
+    def view_workspaces(self, views, output):
+        # same rules as ws_utils.get_workspaces_with_views, computed over one snapshot
+        # where a view spanning several workspaces is saved on the last one
+        monitor = output["geometry"]
+        ws = output["workspace"]
+        grid = [
+            (ws_x, ws_y)
+            for ws_x in range(ws["grid_width"])
+            for ws_y in range(ws["grid_height"])
+        ]
+        workspaces = {}
+        for view in views:
+            if view["output-id"] != output["id"]:
+                continue
+            for ws_x, ws_y in reversed(grid):
+                if self.ws_utils.view_visible_on_workspace(
+                    view["geometry"], ws_x - ws["x"], ws_y - ws["y"], monitor
+                ):
+                    workspaces[view["id"]] = {"x": ws_x, "y": ws_y}
+                    break
+        return workspaces
+
+    def process_cmdlines(self, pids):
+        import psutil
+
+        cmdlines = {}
+        for pid in pids:
+            try:
+                cmdlines[pid] = psutil.Process(pid).cmdline()
+            except (psutil.Error, ValueError):
+                # the process exited or is not ours to inspect, skip its views
+                continue
+        return cmdlines
+
+    def write_session_file(self, path, data):
+        # write next to the old session and rename over it, a crash never leaves half a session
+        tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def session_record(self, view, cmdline, workspaces):
+        view["cmdline"] = cmdline
+        if view["id"] in workspaces:
+            view["workspace"] = workspaces[view["id"]]
+        return json.dumps(view, separators=(",", ":"))
+
+    def session_header(self):
+        return json.dumps({"wayctl-session": SESSION_VERSION}) + "\n"
+
+    def save_views_session(self):
+        views = self.sock.list_views()
+        workspaces = self.view_workspaces(views, self.sock.get_focused_output())
+        cmdlines = self.process_cmdlines({view["pid"] for view in views if view["pid"] > 0})
+
+        saved = [
+            self.session_record(view, cmdlines[view["pid"]], workspaces) + "\n"
+            for view in views
+            if view["pid"] in cmdlines
+        ]
+
+        save_path = self.session_file()
+        self.write_session_file(save_path, self.session_header() + "".join(saved))
+        print(f"Session with {len(saved)} views saved to '{save_path}'.")
+
+    def read_legacy_session(self, file):
+        # indent=4 JSON blobs joined by the LEGACY_SEPARATOR, as saved before the versioned format
+        separator = LEGACY_SEPARATOR.strip("\n") + "\n"
+        blob = []
+        for line in file:
+            if line == separator:
+                yield json.loads("".join(blob))
+                blob = []
+            else:
+                blob.append(line)
+        if "".join(blob).strip():
+            yield json.loads("".join(blob))
+
+    def read_session(self, file):
+        # one record per line, the last record of a view id wins and
+        # {"id": ..., "removed": true} drops it, as appended by the autosave
+        views = {}
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("removed"):
+                views.pop(record["id"], None)
+            else:
+                views[record["id"]] = record
+        return list(views.values())
+
+    def load_wayfire_session(self):
+        load_path = self.session_file()
+        with open(load_path, "r") as file:
+            first = file.readline()
+            try:
+                header = json.loads(first)
+            except ValueError:
+                header = None
+            if not isinstance(header, dict) or "wayctl-session" not in header:
+                file.seek(0)
+                return list(self.read_legacy_session(file))
+            if header["wayctl-session"] > SESSION_VERSION:
+                raise Exception(
+                    "session file '{0}' has version {1}, this wayctl reads up to {2}".format(
+                        load_path, header["wayctl-session"], SESSION_VERSION
+                    )
+                )
+            return self.read_session(file)
+
+    def migrate_session_file(self):
+        views = self.load_wayfire_session()
+        records = "".join(json.dumps(view, separators=(",", ":")) + "\n" for view in views)
+        self.write_session_file(self.session_file(), self.session_header() + records)
+        print(f"Session with {len(views)} views migrated to version {SESSION_VERSION}.")
+
+    def start_app(self, cmdline):
+        return self.stipc.run_cmd(" ".join(cmdline))["pid"]
+
+    def start_wayfire_session(self, parallel=8, timeout=30):
+        views = self.load_wayfire_session()
+        return SessionRestore(self, views, parallel, timeout).run()
+
+    def screenshot_geometry(self):
+        output = self.cached("focused-output", self.sock.get_focused_output)
+        focused_view = self.cached("focused-view", self.sock.get_focused_view)
+        ox = output["geometry"]["x"]
+        oy = output["workarea"]["y"]
+        vwidth = focused_view["geometry"]["width"]
+        vheight = focused_view["geometry"]["height"]
+        view_geometry = "{0},{1} {2}x{3}".format(ox, oy, vwidth, vheight)
+        return view_geometry, focused_view
+
+    def screenshot_view_focused(self, words=()):
+        capture, target = self.capture_options(list(words))
+        focused = self.sock.get_focused_view()
+        data = capture.grab(self.view_region(focused))
+        self.deliver_capture(capture, data, target, f"/tmp/{focused['app-id']}-{focused['id']}.png")
+
+    def screenshot_focused_output(self, words=()):
+        self.screenshot_focused_monitor(words)
+
+    def run_slurp(self):
+        return check_output(["slurp"]).decode().strip()
+
+    def screenshot_slurp(self, words=()):
+        capture, target = self.capture_options(list(words))
+        slurp = self.run_slurp()
+        focused = self.sock.get_focused_view()
+        data = capture.grab(slurp)
+        self.deliver_capture(capture, data, target, f"/tmp/{focused['app-id']}-{focused['id']}.png")
+
+    def screenshot_slurp_focused_view(self, words=()):
+        capture, target = self.capture_options(list(words))
+        focused = self.sock.get_focused_view()
+        # freeze the view in a viewer so slurp gets the pointer back from the game,
+        # the viewer needs a file but it is the only one written
+        frame = ScreenCapture("ppm").grab(self.view_region(focused))
+        frame_path = f"/tmp/{focused['app-id']}-{focused['id']}.ppm"
+        ScreenCapture("ppm").deliver(frame, frame_path)
+        with EventWatcher(["view-mapped"]) as watcher:
+            Popen(["xdg-open", frame_path])
+            for event in watcher.events(5):
+                if event.get("event") == "view-mapped":
+                    break
+        slurp = self.run_slurp()
+        data = capture.grab(slurp)
+        self.deliver_capture(capture, data, target, f"/tmp/{focused['app-id']}-{focused['id']}-slurp.png")
+
+    def generate_screenshot_info(self, view, filename):
+        # view is a list-views entry, the label needs no request of its own
+        ViewAnnotator().render_label(view, filename)
+
+    def capture_screen_pixel(self):
+        color_code = ColorPicker().pick(self.run_slurp())
+        Popen(["wl-copy", color_code])
+        return color_code
+
+    def screenshot_view_id(self, view_id, filename):
+        self.screenshot(view_id, filename)
+
+    def screenshot_timelapse(self, words):
+        if words[:1] == ["extract"]:
+            # extract <archive> [frame <n>] [to ...] [format ...] [level ...], the last frame by default
+            options = dict(zip(words[2::2], words[3::2]))
+            capture, target = self.capture_options(words[2:])
+            data = capture.encode_ppm(Timelapse(words[1]).frame(int(options.get("frame", -1))))
+            archive = os.path.abspath(words[1])
+            self.deliver_capture(capture, data, target, "{0}-{1}.png".format(archive, options.get("frame", "last")))
+            return
+        if words[:1] == ["info"]:
+            print(json.dumps(Timelapse(words[1]).info(), indent=4))
+            return
+
+        import numpy as np
+
+        options = dict(zip(words[::2], words[1::2]))
+        timelapse = Timelapse(
+            options.get("archive", "/tmp/timelapse.wtl"),
+            int(options.get("tile", 64)),
+            int(options.get("keyframe", 300)),
+        )
+        interval = float(options.get("interval", 1))
+        frames = int(options["frames"]) if "frames" in options else None
+        capture = ScreenCapture("ppm")
+        if "view" in options:
+            view_id = options["view"]
+            if view_id == "focused":
+                view_id = self.sock.get_focused_view()["id"]
+            view_id = int(view_id)
+            output = None
+        else:
+            name = options.get("output", "focused")
+            if name == "focused":
+                name = self.sock.get_focused_output()["name"]
+
+        count = changed = written = 0
+        next_frame = time.monotonic()
+        try:
+            while frames is None or count < frames:
+                if "view" in options:
+                    view = self.sock.get_view(view_id)
+                    if output is None:
+                        output = self.sock.get_output(view["output-id"])
+                    width, height, _, pixels = read_ppm(capture.grab(self.view_region(view, output)))
+                else:
+                    width, height, _, pixels = read_ppm(capture.grab(output=name))
+                frame = np.frombuffer(pixels, dtype=np.uint8, count=width * height * 3).reshape(height, width, 3)
+                tiles, size = timelapse.add(frame, time.time())
+                count += 1
+                changed += tiles
+                written += size
+                next_frame += interval
+                delay = next_frame - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # fell behind, do not burst to catch up
+                    next_frame = time.monotonic()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            timelapse.close()
+        print(
+            "{0} frames into {1}, {2} changed tiles, {3} bytes written".format(
+                count, timelapse.path, changed, written
+            )
+        )
+
+    def create_directory(self, directory):
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+
+    def screenshot_view_list(self, app_id=None, workspace=None, fmt=None, workers=4, sheet=None, columns=5):
+        capture = ViewCapture(self, "/tmp/screenshots", fmt, workers)
+        views = capture.select(self.sock.list_views(), app_id, workspace)
+        captured = capture.run(views)
+        if sheet is not None:
+            # labels come from the same snapshot the views were captured from
+            ViewAnnotator(workers=workers).contact_sheet(captured, sheet, columns)
+            self.xdg_open(sheet)
+            return
+        Popen("xdg-open /tmp/screenshots".split())
+
+    def set_dpms(self, state, names=None):
+        if names is None:
+            names = [output["name"] for output in self.sock.list_outputs()]
+        # a single output is one wlopm call, not worth starting an event loop for
+        if len(names) == 1:
+            call(["wlopm", "--" + state, names[0]])
+            return
+        import asyncio
+
+        asyncio.run(set_dpms(state, names))
+
+    def dpms(self):
+        if "off_all" in self.args.dpms:
+            self.set_dpms("off")
+        if "on_all" in self.args.dpms:
+            self.set_dpms("on")
+        if "on" in self.args.dpms:
+            monitor_name = self.args.dpms[-1].strip()
+            self.set_dpms("on", [monitor_name])
+        if "off" in self.args.dpms:
+            if "timeout" in self.args.dpms:
+                monitor_name = self.args.dpms[1].strip()
+                timeout = int(self.args.dpms[3].strip())
+                if scheduler is not None:
+                    # in the daemon the output goes off from its timer, nobody sleeps
+                    job = scheduler.add("in", timeout, ["--dpms", "off", monitor_name])
+                    print("scheduled job {0}".format(job["id"]))
+                    return
+                time.sleep(int(timeout))
+                self.set_dpms("off", [monitor_name])
+            elif len(self.args.dpms) > 1:
+                # the scheduler's "--dpms off <monitor>" lands here, only that output goes off
+                self.set_dpms("off", [self.args.dpms[-1].strip()])
+            else:
+                self.set_dpms("off")
+        if "toggle" in self.args.dpms:
+            focused_output = self.sock.get_focused_output()
+            self.set_dpms("toggle", [focused_output["name"]])
+
+    def schedule(self, words):
+        if scheduler is None:
+            print("--schedule needs a running wayctl --daemon", file=sys.stderr)
+            sys.exit(1)
+        if words[:1] == ["list"]:
+            now = time.monotonic()
+            for job in scheduler.list():
+                due = "waiting for a focus change" if job["due"] is None else "next in {0:.0f}s".format(job["due"] - now)
+                print("{0}  {1} {2}s  {3}  {4}".format(job["id"], job["kind"], job["seconds"], due, " ".join(job["argv"])))
+        elif words[:1] == ["cancel"]:
+            if not scheduler.cancel(int(words[1])):
+                print("no scheduled job {0}".format(words[1]), file=sys.stderr)
+                sys.exit(1)
+        elif words[:1] and words[0] in Scheduler.KINDS:
+            job = scheduler.add(words[0], float(words[1]), words[2:])
+            print("scheduled job {0}".format(job["id"]))
+        else:
+            raise ValueError("use --schedule in/every/idle <seconds> <wayctl arguments>, list or cancel <id>")
+
+    def layout_engine(self, gap=0):
+        # one pipelined read for the whole layout, the focused view is the last one focused
+        views, output = send_pipelined(
+            self.sock,
+            [get_msg_template("window-rules/list-views"), get_msg_template("window-rules/get-focused-output")],
+        )
+        for reply in (views, output):
+            if isinstance(reply, Exception):
+                raise reply
+        return LayoutEngine(views, output["info"], gap)
+
+    def apply_layout(self, engine, targets):
+        changed = engine.changes(targets)
+        requests = []
+        for view_id, geom in changed.items():
+            msg = get_msg_template("window-rules/configure-view")
+            msg["data"]["id"] = view_id
+            msg["data"]["geometry"] = geom
+            requests.append(msg)
+        for reply in send_pipelined(self.sock, requests):
+            if isinstance(reply, Exception):
+                print("configure-view failed: {0}".format(reply), file=sys.stderr)
+        return changed
+
+    def layout_views(self, layout, ratio=0.55, gap=0):
+        if layout not in ("split", "stack", "master"):
+            usage_error("unknown layout '{0}', use split, stack or master".format(layout))
+        engine = self.layout_engine(gap)
+        if layout == "split":
+            targets = engine.split()
+        elif layout == "stack":
+            targets = engine.stack()
+        else:
+            targets = engine.master(ratio)
+        self.apply_layout(engine, targets)
+
+    def switch_views_side(self):
+        engine = self.layout_engine()
+        self.apply_layout(engine, engine.swap())
+
+    def resize_views(self, direction, step=50, grow=True):
+        engine = self.layout_engine()
+        self.apply_layout(engine, engine.resize(direction, step, grow))
+
+    def view_list(self):
+        query = ViewQuery(self.args.view[1:])
+        state = read_state()
+        if state is None:
+            state = {"views": self.sock.list_views()}
+        views = state["views"]
+        workspaces = None
+        if query.workspace is not None:
+            # the only filter that needs a second request without the cache
+            output = state.get("focused-output") or self.sock.get_focused_output()
+            workspaces = self.view_workspaces(views, output)
+        query.write(query.select(views, workspaces), sys.stdout)
+
+    def list_plugins(self):
+        plugins = self.list_plugins()
+        for plugin in plugins:
+            print(plugin)
+            print(plugins[plugin])
+            print("\n")
+
+        print("Enabled Plugins ")
+        print(self.list_enabled_plugins())
+
+    def _reload_plugin(self, plugin_name):
+        self.reload_plugin(plugin_name)
+
+    def enable_plugin(self, plugin_name):
+        self.enable_plugin(plugin_name)
+
+    def disable_plugin(self, plugin_name):
+        self.disable_plugin(plugin_name)
+
+
+    def trace_mode(self):
+        # --trace [chrome <file>], or WAYCTL_TRACE=summary|<file> for every command of a daemon
+        if self.args.trace is not None:
+            if self.args.trace[:1] == ["chrome"]:
+                path = self.args.trace[1] if len(self.args.trace) > 1 else "wayctl-trace.json"
+                if os.path.exists(path):
+                    os.remove(path)
+                return path
+            return "summary"
+        return os.getenv("WAYCTL_TRACE") or None
+
+    def run(self):
+        mode = self.trace_mode()
+        if mode is None:
+            return self.run_commands()
+        with Tracer(mode):
+            return self.run_commands()
+
+    # the cyclomatic complexity became to high, need a better way to deal with
+    def run_commands(self):
+        if self.args.view is not None:
+            if "focused" in self.args.view[0]:
+                self.view_focused()
+                return
+
+            if "list" in self.args.view[0]:
+                self.view_list()
+                return
+
+            if self.args.view[0] == "at":
+                self.view_at(int(self.args.view[1]), int(self.args.view[2]))
+                return
+
+        if self.args.dpms is not None:
+            self.dpms()
+
+        if self.args.schedule is not None:
+            self.schedule(self.args.schedule)
+
+        if self.args.colorpicker is not None:
+            words = self.args.colorpicker
+            if words and words[0] == "region":
+                options = dict(zip(words[1::2], words[2::2]))
+                picker = ColorPicker(int(options.get("palette", 5)))
+                print(json.dumps(picker.region(options.get("geometry") or self.run_slurp()), indent=4))
+            elif words and words[0] == "watch":
+                options = dict(zip(words[1::2], words[2::2]))
+                ColorPicker().watch(options.get("geometry") or self.run_slurp(), float(options.get("rate", 10)))
+            else:
+                color_code = self.capture_screen_pixel()
+                print(color_code)
+
+        if self.args.screenshot is not None:
+            if "focused" in self.args.screenshot[0]:
+                if "view" in self.args.screenshot[1]:
+                    self.screenshot_view_focused(self.args.screenshot[2:])
+
+            if "slurp" in self.args.screenshot[0]:
+                if len(self.args.screenshot) == 1 or self.args.screenshot[1] != "focused":
+                    self.screenshot_slurp(self.args.screenshot[1:])
+                elif "focused" in self.args.screenshot[1]:
+                    if "view" in self.args.screenshot[2]:
+                        # this method is for gaming, in case you want slurp a game
+                        # will take screenshot of the whole game view, open the screenshot
+                        # and start slurp, after you select the area, it will give the final screenshot
+                        # you can't slurp while gaming right, because the game has the mouse focus
+                        self.screenshot_slurp_focused_view(self.args.screenshot[3:])
+
+            if "focused" in self.args.screenshot[0]:
+                if "output" in self.args.screenshot[1]:
+                    self.screenshot_focused_output(self.args.screenshot[2:])
+
+            if "output" in self.args.screenshot[0]:
+                if "all" in self.args.screenshot[1]:
+                    self.screenshot_all_outputs(self.args.screenshot[2:])
+
+            if self.args.screenshot[0] == "timelapse":
+                self.screenshot_timelapse(self.args.screenshot[1:])
+
+            if "view" in self.args.screenshot[0]:
+                if "all" in self.args.screenshot[1]:
+                    options = dict(zip(self.args.screenshot[2::2], self.args.screenshot[3::2]))
+                    self.screenshot_view_list(
+                        options.get("app-id"),
+                        options.get("workspace"),
+                        options.get("format"),
+                        int(options.get("workers", 4)),
+                        options.get("sheet"),
+                        int(options.get("columns", 5)),
+                    )
+
+        if self.args.workspace is not None:
+            if "set" in self.args.workspace[0]:
+                if "view" in self.args.workspace[1]:
+                    if "focused" in self.args.workspace[2]:
+                        wx = int(self.args.workspace[-1])
+                        wy = int(self.args.workspace[-2])
+                        ws = {"x": wx, "y": wy}
+                        focused_view_id = self.sock.get_focused_view()["id"]
+                        self.sock.set_workspace(ws, focused_view_id)
+
+        if self.args.session is not None:
+            # compared exactly, "save" is also a substring of "autosave"
+            if self.args.session[0] == "save":
+                self.save_views_session()
+
+            if "autosave" in self.args.session[0]:
+                options = dict(zip(self.args.session[1::2], self.args.session[2::2]))
+                SessionAutosave(self, float(options.get("delay", 2))).run()
+
+            if "migrate" in self.args.session[0]:
+                self.migrate_session_file()
+
+            if "start" in self.args.session[0]:
+                options = dict(zip(self.args.session[1::2], self.args.session[2::2]))
+                self.start_wayfire_session(
+                    int(options.get("parallel", 8)), float(options.get("timeout", 30))
+                )
+
+        if self.args.switch is not None:
+            if "views" in self.args.switch[0]:
+                self.switch_views_side()
+
+        if self.args.resize is not None:
+            if "views" in self.args.resize[0]:
+                words = self.args.resize[1:]
+                grow = "shrink" not in words
+                step = int(words[words.index("step") + 1]) if "step" in words else 50
+                direction = next((word for word in words if word in LayoutEngine.DIRECTIONS), None)
+                if direction is None:
+                    usage_error("missing direction, use --resize views [shrink] left/right/up/down [step <px>]")
+                self.resize_views(direction, step, grow)
+
+        if self.args.layout is not None:
+            options = dict(zip(self.args.layout[1::2], self.args.layout[2::2]))
+            self.layout_views(self.args.layout[0], float(options.get("ratio", 0.55)), int(options.get("gap", 0)))
+
+        if self.args.focus is not None:
+            self.focus_direction(self.args.focus[0], self.args.move_cursor is not None)
+
+        if self.args.move_cursor:
+            x = self.args.move_cursor[0]
+            y = self.args.move_cursor[1]
+            self.move_cursor(int(x), int(y))
+
+        if self.args.plugin is not None:
+            if "reload" in self.args.plugin:
+                if self.args.plugin[1] != "all":
+                    self._reload_plugin(self.args.plugin[1])
+            if "enable" in self.args.plugin:
+                self.enable_plugin(self.args.plugin[1])
+            if "disable" in self.args.plugin:
+                self.disable_plugin(self.args.plugin[1])
+            if "list" in self.args.plugin:
+                self.list_plugins()
+
+        if self.args.drop is not None:
+            cmd = self.args.drop[0]
+            timeout = 5
+            if "timeout" in self.args.drop:
+                timeout = float(self.args.drop[-1])
+            drop = ViewDropDown(cmd, timeout)
+            drop.run()
+
+        if self.args.output is not None:
+            if "list" in self.args.output[0]:
+                if "views" in self.args.output[1]:
+                    output = self.ws_utils.focused_output_views()
+                    pprint.pprint(output)
+
+            if "focused" in self.args.output[0]:
+                output = self.cached("focused-output", self.sock.get_focused_output)
+                output = json.dumps(output, indent=4)
+                print(output)
+
+
+class RunLocally(Exception):
+    """Raised by a command the daemon hands back to its client, to run in the client's own process."""
+
+
+def run_captured(parser, argv):
+    """Run one wayctl command line in this process and capture what it prints."""
+    stdout, stderr = io.StringIO(), io.StringIO()
+    status = 0
+    failed = False
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            Wayctl(parser.parse_args(argv)).run()
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        except RunLocally:
+            raise
+        except Exception:
+            traceback.print_exc()
+            status = 1
+            failed = True
+    return {"status": status, "stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "failed": failed}
+
+
+class CommandBatch:
+    """Run many command lines over one connection, deferring writes so they go out pipelined."""
+
+    # requests whose reply nobody reads, they are queued and sent together
+    DEFERRED_VERBS = ("set", "configure", "focus", "close", "send", "move", "layout", "bring", "assign", "unblock")
+    # lookups answered once per batch, dropped when a request may have changed the focus
+    SHARED_LOOKUPS = ("window-rules/get-focused-view", "window-rules/get-focused-output")
+    # writes after which the focused view or output may be another one
+    FOCUS_CHANGING = ("focus", "close", "minimized", "workspace", "output", "showdesktop")
+    # these never finish or need their own process
+    REFUSED = ("--daemon", "--batch", "--watch")
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.pending = []
+        self.lookups = {}
+        self.errors = {}
+        self.line = None
+
+    def deferred(self, method):
+        verb = method.split("/")[-1]
+        return verb.startswith(self.DEFERRED_VERBS)
+
+    def changes_focus(self, method):
+        return self.deferred(method) and any(word in method for word in self.FOCUS_CHANGING)
+
+    def send_json(self, msg):
+        method = msg["method"]
+        if self.deferred(method):
+            if self.changes_focus(method):
+                self.lookups.clear()
+            self.pending.append((self.line, msg))
+            return {"result": "ok"}
+        if method in self.SHARED_LOOKUPS and method in self.lookups:
+            return self.lookups[method]
+        # a lookup sees the effect of every write queued before it
+        self.flush()
+        reply = self.live_send_json(msg)
+        if method in self.SHARED_LOOKUPS:
+            self.lookups[method] = reply
+        return reply
+
+    def send_pipelined(self, messages):
+        # the queued writes go out first, in the same write as these
+        if any(self.changes_focus(msg["method"]) for msg in messages):
+            self.lookups.clear()
+        pending, self.pending = self.pending, []
+        replies = send_pipelined_live(self.sock, [msg for _, msg in pending] + list(messages))
+        for (line, msg), reply in zip(pending, replies):
+            if isinstance(reply, Exception):
+                self.errors.setdefault(line, []).append("{0}: {1}".format(msg["method"], reply))
+        return replies[len(pending):]
+
+    def flush(self):
+        if self.pending:
+            self.send_pipelined([])
+
+    def commands(self, file):
+        import shlex
+
+        for number, line in enumerate(file, 1):
+            argv = shlex.split(line, comments=True)
+            if argv and argv[0] in ("wayctl", "wayctl.py"):
+                argv = argv[1:]
+            if argv:
+                yield number, argv
+
+    def run(self, file, out=sys.stdout):
+        global use_state_cache
+        use_state_cache = False
+        self.sock = get_sock()
+        self.live_send_json = self.sock.send_json
+        # pywayfire, stipc and ws_utils all call send_json on this one socket
+        self.sock.send_json = self.send_json
+        self.sock.send_pipelined = self.send_pipelined
+        results = []
+        try:
+            for number, argv in self.commands(file):
+                self.line = number
+                if set(argv) & set(self.REFUSED) or "autosave" in argv or "watch" in argv:
+                    results.append((number, argv, {"status": 2, "stdout": "", "stderr": "not allowed in a batch\n"}))
+                    continue
+                reply = run_captured(self.parser, argv)
+                reply.pop("failed")
+                results.append((number, argv, reply))
+            self.flush()
+        finally:
+            del self.sock.send_json
+            del self.sock.send_pipelined
+
+        failed = 0
+        for number, argv, reply in results:
+            errors = self.errors.get(number, [])
+            if errors and reply["status"] == 0:
+                reply["status"] = 1
+            if reply["status"] != 0:
+                failed += 1
+            reply["stderr"] += "".join(error + "\n" for error in errors)
+            out.write(json.dumps(dict(line=number, command=" ".join(argv), **reply), separators=(",", ":")) + "\n")
+        return 1 if failed else 0
+
+
+class Scheduler:
+    """Timer heap of delayed, recurring and idle wayctl command lines, run by the daemon.
+
+    Jobs sleep in the heap rather than in processes of their own. The thread
+    waits on the next due time, a wakeup pipe for new jobs and the compositor's
+    view-focused events, which re-arm the idle jobs. Cancelled or re-armed jobs
+    leave stale heap entries behind, an entry only fires when its due time is
+    still the job's.
+    """
+
+    KINDS = ("in", "every", "idle")
+    EVENTS = ["view-focused"]
+
+    def __init__(self, execute):
+        import heapq
+
+        self.heapq = heapq
+        self.execute = execute
+        self.heap = []
+        self.jobs = {}
+        self.next_id = 1
+        self.lock = threading.Lock()
+        self.wakeup_read, self.wakeup_write = os.pipe()
+
+    def add(self, kind, seconds, argv):
+        if kind not in self.KINDS:
+            raise ValueError("unknown schedule '{0}', use in, every or idle".format(kind))
+        if seconds <= 0 and kind == "every":
+            raise ValueError("a recurring job needs a positive interval")
+        if not argv or not daemon_forwardable(argv):
+            # the same commands that would stall the daemon would stall its timers
+            raise ValueError("'{0}' can't be scheduled".format(" ".join(argv)))
+        with self.lock:
+            # added from a running command, so this is the directory of whoever scheduled it
+            job = {"id": self.next_id, "kind": kind, "seconds": seconds, "argv": list(argv), "cwd": os.getcwd(), "due": None}
+            self.next_id += 1
+            self.jobs[job["id"]] = job
+            self.arm(job, time.monotonic() + seconds)
+        os.write(self.wakeup_write, b"\0")
+        return job
+
+    def arm(self, job, due):
+        job["due"] = due
+        self.heapq.heappush(self.heap, (due, job["id"]))
+
+    def cancel(self, job_id):
+        with self.lock:
+            return self.jobs.pop(job_id, None) is not None
+
+    def list(self):
+        with self.lock:
+            return sorted((dict(job) for job in self.jobs.values()), key=lambda j: (j["due"] is None, j["due"] or 0))
+
+    def activity(self):
+        # a focus change restarts every idle countdown
+        now = time.monotonic()
+        with self.lock:
+            for job in self.jobs.values():
+                if job["kind"] == "idle":
+                    self.arm(job, now + job["seconds"])
+
+    def due_jobs(self):
+        now = time.monotonic()
+        jobs = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                due, job_id = self.heapq.heappop(self.heap)
+                job = self.jobs.get(job_id)
+                if job is None or job["due"] != due:
+                    continue
+                if job["kind"] == "every":
+                    # missed runs are skipped, not replayed in a burst
+                    next_due = due + job["seconds"]
+                    while next_due <= now:
+                        next_due += job["seconds"]
+                    self.arm(job, next_due)
+                elif job["kind"] == "idle":
+                    job["due"] = None
+                else:
+                    del self.jobs[job_id]
+                jobs.append(job)
+        return jobs
+
+    def timeout(self):
+        with self.lock:
+            if not self.heap:
+                return None
+            return max(0, self.heap[0][0] - time.monotonic())
+
+    def run(self):
+        with EventWatcher(self.EVENTS) as watcher:
+            while True:
+                for job in self.due_jobs():
+                    reply = self.execute(job["argv"], job["cwd"])
+                    if reply["status"] != 0:
+                        print(
+                            "wayctl daemon: scheduled job {0} failed: {1}".format(job["id"], reply["stderr"].strip()),
+                            file=sys.stderr,
+                        )
+                if watcher.sock.pending_events:
+                    readable = [watcher.sock.client]
+                else:
+                    readable, _, _ = select.select([watcher.sock.client, self.wakeup_read], [], [], self.timeout())
+                if self.wakeup_read in readable:
+                    os.read(self.wakeup_read, 4096)
+                if watcher.sock.client in readable:
+                    if watcher.next_event(0) is not None:
+                        self.activity()
+
+
+class WayctlDaemon:
+    """Serve wayctl command lines over a unix socket with a single warm wayfire connection."""
+
+    def __init__(self, path=DAEMON_SOCKET):
+        self.path = path
+        self.parser = build_parser()
+        # clients and scheduled jobs share the connection and the redirected stdout, one at a time
+        self.lock = threading.Lock()
+        self.state = StateCache()
+
+    def execute(self, argv, cwd=None):
+        with self.lock:
+            # the working directory is process wide, it only changes while holding the lock
+            home = os.getcwd()
+            try:
+                if cwd is not None:
+                    os.chdir(cwd)
+                reply = run_captured(self.parser, argv)
+            except RunLocally as e:
+                # the client runs it itself, a scheduled job only logs this
+                reply = {"status": 1, "stdout": "", "stderr": "wayctl daemon: {0}\n".format(e), "failed": False, "local": True}
+            except OSError as e:
+                reply = {"status": 1, "stdout": "", "stderr": "wayctl daemon: {0}\n".format(e), "failed": False}
+            finally:
+                os.chdir(home)
+            if reply.pop("failed"):
+                # the compositor may have gone away, start the next command fresh
+                disconnect()
+            if self.mutating(argv):
+                # read after write: the next command must not be answered from before this one
+                self.state.stale()
+        return reply
+
+    def handle(self, client):
+        # the framing is described in wayctl.py, the client reads it without json
+        with client:
+            data = bytearray()
+            while True:
+                chunk = client.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+            if not data:
+                return
+            cwd, *argv = [os.fsdecode(word) for word in bytes(data).split(b"\0")]
+            reply = self.execute(argv, cwd)
+            if reply.get("local"):
+                # closing without a reply hands the command back to the client
+                return
+            stdout = reply["stdout"].encode("utf-8", "backslashreplace")
+            stderr = reply["stderr"].encode("utf-8", "backslashreplace")
+            client.sendall(
+                reply["status"].to_bytes(4, "little", signed=True) + len(stdout).to_bytes(4, "little") + stdout + stderr
+            )
+
+    # options that only read the compositor, any other command may leave the state cache behind
+    READ_ONLY = ("--view", "--output", "--screenshot", "--colorpicker", "--schedule", "--dpms", "--help", "-h")
+
+    def mutating(self, argv):
+        options = [word for word in argv if word.startswith("-")]
+        # the arguments after --schedule are the job's, not this command's
+        if "--schedule" in options:
+            options = options[:options.index("--schedule") + 1]
+        return any(option not in self.READ_ONLY for option in options)
+
+    def keep_state(self):
+        try:
+            self.state.run()
+        except Exception as e:
+            # without the cache every command queries the compositor, the daemon keeps serving
+            print("wayctl daemon: state cache stopped: {0}".format(e), file=sys.stderr)
+
+    def keep_schedule(self):
+        try:
+            scheduler.run()
+        except Exception as e:
+            print("wayctl daemon: scheduler stopped: {0}".format(e), file=sys.stderr)
+
+    def serve(self):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        with probe:
+            if probe.connect_ex(self.path) == 0:
+                print("wayctl daemon already running on {0}".format(self.path))
+                return 1
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        os.chmod(self.path, 0o600)
+        server.listen(16)
+        threading.Thread(target=self.keep_state, daemon=True).start()
+        global scheduler
+        scheduler = Scheduler(self.execute)
+        threading.Thread(target=self.keep_schedule, daemon=True).start()
+        try:
+            while True:
+                client, _ = server.accept()
+                try:
+                    self.handle(client)
+                except (OSError, ValueError, KeyError) as e:
+                    print("wayctl daemon: dropped request: {0}".format(e), file=sys.stderr)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            os.remove(self.path)
+        return 0
+
+
+def main():
+    wayctl = Wayctl()
+    if wayctl.args.daemon:
+        return WayctlDaemon().serve()
+    if wayctl.args.watch is not None:
+        options = dict(zip(wayctl.args.watch[::2], wayctl.args.watch[1::2]))
+        events = options.get("event")
+        EventStream(
+            events.split(",") if events else None,
+            options.get("app-id"),
+            options.get("output"),
+            int(options.get("queue", 1024)),
+        ).run()
+        return 0
+    if wayctl.args.batch is not None:
+        if wayctl.args.batch == "-":
+            return CommandBatch(build_parser()).run(sys.stdin)
+        with open(wayctl.args.batch) as f:
+            return CommandBatch(build_parser()).run(f)
+    wayctl.run()
+    return 0